@@ -0,0 +1,288 @@
+import sys
+from itertools import repeat
+from Disassembler import Disassembler
+from Instruction import Instruction
+from TraceWriter import TraceWriter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class BatchDisassembler:
+    """
+    Disassembles a whole input at once with NumPy. The words are loaded into a uint32 array and every field of
+    every format is extracted with vectorized shifts and masks, giving a columnar (struct-of-arrays) instruction
+    table instead of one Instruction per word.
+    """
+    # format codes used in the 'format' column
+    formats = ['R', 'D', 'I', 'B', 'CB', 'IM', 'NOP', 'BREAK']
+
+    # format : (template of the address, name and operands, field columns filling the operands), giving the same
+    # text as Instruction.assembly; shifts use 'shift' and the IM shift field is printed times 16
+    templates = {
+        'R': ('{}\t{}\tR{}, R{}, R{}', ('rd', 'rn', 'rm')),
+        'shift': ('{}\t{}\tR{}, R{}, #{}', ('rd', 'rn', 'shamt')),
+        'D': ('{}\t{}\tR{}, [R{}, #{}]', ('rt', 'rn', 'offset')),
+        'I': ('{}\t{}\tR{}, R{}, #{}', ('rd', 'rn', 'immediate')),
+        'B': ('{}\t{}\t#{}', ('offset',)),
+        'CB': ('{}\t{}\tR{}, #{}', ('rt', 'offset')),
+        'IM': ('{}\t{}\tR{}, {}, LSL {}', ('rd', 'immediate', 'shift')),
+        'NOP': ('{}\t{}', ()),
+        'BREAK': ('{}\t{}', ())
+    }
+
+    # words formatted at a time when writing the _dis.txt output
+    chunk_words = 1 << 16
+
+    def __init__(self, input_file, output_file=None, compression=None, input_format='text'):
+        if np is None:
+            raise ValueError('ERROR: Batch disassembly requires the numpy package')
+        if input_format not in Disassembler.input_formats:
+            raise ValueError('ERROR: Unknown input format \'{}\''.format(input_format))
+
+        self.__input_file = input_file
+        self.__output_file = output_file
+        self.__compression = compression
+        self.__input_format = input_format
+        self.__table = None
+        self.__processed_inst = None
+
+        # Build the opcode -> format code and opcode -> name code lookups from the scalar opcode table
+        self.__names = []
+        self.__format_lut = np.full(2048, -1, dtype=np.int8)
+        self.__name_lut = np.full(2048, -1, dtype=np.int16)
+        for opcode, entry in enumerate(Disassembler.opcode_table):
+            if entry is not None:
+                inst_name = entry[1]
+                if inst_name not in self.__names:
+                    self.__names.append(inst_name)
+                self.__name_lut[opcode] = self.__names.index(inst_name)
+        for (low, high), (inst_format, inst_name) in Disassembler.opcode_dict.items():
+            self.__format_lut[low:high + 1] = BatchDisassembler.formats.index(inst_format)
+
+    def run(self):
+        """
+        Loads and decodes the input, then writes the _dis.txt output if an output file was given
+        :return: The columnar instruction table
+        """
+        try:
+            byteorder = Disassembler.input_formats[self.__input_format]
+            if byteorder is None:
+                words = self.load(self.__input_file)
+            else:
+                words = self.load_image(self.__input_file, byteorder)
+            self.__table = self.decode(words)
+            self.__processed_inst = None
+            if self.__output_file is not None:
+                self.__write_output()
+        except ValueError as ve:
+            print(ve, file=sys.stderr)
+            quit()
+        return self.__table
+
+    def get_table(self):
+        return self.__table
+
+    @staticmethod
+    def load(input_file):
+        """
+        Reads a file of 32-character binary lines into a uint32 array without parsing each line separately
+        :param input_file: The path of the text input
+        :return: A uint32 array with one word per line
+        """
+        with open(input_file, 'rb') as f:
+            raw = f.read()
+        if raw and not raw.endswith(b'\n'):
+            raw += b'\n'
+
+        chars = np.frombuffer(raw, dtype=np.uint8)
+        if len(chars) % 33 == 0:
+            lines = chars.reshape(-1, 33)
+            bits = lines[:, :32] - ord('0')
+            if (lines[:, 32] == ord('\n')).all() and (bits <= 1).all():
+                return np.packbits(bits, axis=1).view('>u4').ravel().astype(np.uint32)
+
+        # Uneven lines (blank lines, \r\n endings or an invalid line): validate line by line
+        words = []
+        for line_num, line in enumerate(raw.decode().splitlines(), 1):
+            line = line.rstrip()
+            if len(line) != 32:
+                raise ValueError('ERROR: Invalid instruction on line {}: \'{}\''.format(line_num, line))
+            words.append(int(line, 2))
+        return np.array(words, dtype=np.uint32)
+
+    @staticmethod
+    def load_image(input_file, byteorder):
+        """
+        Maps a raw binary image of 32-bit words as a read-only array without copying it
+        :param input_file: The path of the binary image
+        :param byteorder: The byte order of the image, 'little' or 'big'
+        :return: A uint32 array backed by the file
+        """
+        dtype = np.dtype('<u4' if byteorder == 'little' else '>u4')
+        with open(input_file, 'rb') as f:
+            size = f.seek(0, 2)
+        if size % 4:
+            raise ValueError('ERROR: Binary image size {} is not a multiple of 4 bytes'.format(size))
+        if size == 0:
+            return np.zeros(0, dtype=np.uint32)
+        return np.memmap(input_file, dtype=dtype, mode='r')
+
+    def decode(self, words):
+        """
+        Decodes every word at once. Words up to and including the first BREAK are instructions, the rest are data.
+        :param words: A uint32 array of the input words
+        :return: A dictionary of columns: 'address', 'word', 'format' and 'name' (codes into formats and
+        get_names()) for the instructions, 'fields' mapping each format to a dictionary of field columns, and
+        'data_address' and 'data' for the data words
+        """
+        words = np.asarray(words, dtype=np.uint32)
+        breaks = np.flatnonzero(words == Disassembler.break_inst)
+        num_inst = breaks[0] + 1 if len(breaks) else len(words)
+
+        inst = words[:num_inst]
+        opcode = inst >> 21
+        format_code = self.__format_lut[opcode]
+
+        # Unknown opcodes, and words with a zero opcode that are not all zeros, are invalid
+        nop = format_code == BatchDisassembler.formats.index('NOP')
+        invalid = np.flatnonzero((format_code < 0) | (nop & (inst != 0)))
+        if len(invalid):
+            # Decode the first invalid word with the scalar decoder, which raises the same error as a scalar run
+            line_num = int(invalid[0])
+            Disassembler.process_chunk([int(inst[line_num])], line_num, False)
+
+        # Extract every field of every format for all words, using the same layouts as the scalar decoder
+        inst64 = inst.astype(np.int64)
+        fields = {}
+        for inst_format, layout in Disassembler.field_layouts.items():
+            fields[inst_format] = {}
+            for name, high, low, signed in layout:
+                width = high - low + 1
+                column = (inst64 >> low) & ((1 << width) - 1)
+                if signed:
+                    column -= (column >> (width - 1)) << width
+                fields[inst_format][name] = column
+
+        data = words[num_inst:]
+        return {
+            'address': 96 + 4 * np.arange(num_inst, dtype=np.int64),
+            'word': inst,
+            'format': format_code,
+            'name': self.__name_lut[opcode],
+            'fields': fields,
+            'data_address': 96 + 4 * np.arange(num_inst, len(words), dtype=np.int64),
+            'data': data.view(np.int32).astype(np.int64)
+        }
+
+    def get_names(self):
+        """
+        Returns the instruction names indexed by the codes in the 'name' column.
+        :return: A list of instruction names.
+        """
+        return self.__names
+
+    def get_processed_inst(self):
+        """
+        Converts the columnar table to the mem_address : Instruction form produced by Disassembler. The conversion
+        runs once, with one pass per format, and later calls return the same dictionary.
+        :return: A dictionary of processed instructions.
+        """
+        if self.__processed_inst is None:
+            table = self.__table
+            names = np.array(self.__names, dtype=object)
+            processed = np.empty(len(table['word']), dtype=object)
+            for format_code, inst_format in enumerate(BatchDisassembler.formats):
+                rows = np.flatnonzero(table['format'] == format_code)
+                if not len(rows):
+                    continue
+                # Instruction takes the fields positionally in __slots__ order, None for fields of other formats
+                layout = table['fields'].get(inst_format, {})
+                columns = [layout[field][rows].tolist() if field in layout else repeat(None)
+                           for field in Instruction.__slots__[3:]]
+                processed[rows] = list(map(Instruction, table['address'][rows].tolist(),
+                                           names[table['name'][rows]].tolist(), repeat(inst_format), *columns))
+            self.__processed_inst = dict(zip(table['address'].tolist(), processed.tolist()))
+        return self.__processed_inst
+
+    def get_processed_data(self):
+        """
+        Converts the data columns to the mem_address : decimal value form produced by Disassembler.
+        :return: A dictionary of data values.
+        """
+        return dict(zip(self.__table['data_address'].tolist(), self.__table['data'].tolist()))
+
+    @staticmethod
+    def binary_strings(words, spaced):
+        """
+        Prints words as 32-bit binary strings followed by a tab, all at once
+        :param words: A uint32 array of words
+        :param spaced: Whether to space the bits into the groups of Disassembler.get_bin_spaced
+        :return: A list of strings
+        """
+        bits = np.unpackbits(words.astype('>u4').view(np.uint8).reshape(-1, 4), axis=1) + ord('0')
+        spacing = Disassembler.inst_spacing
+        if spaced:
+            width = 32 + len(spacing)
+            chars = np.full((len(words), width), ord(' '), dtype=np.uint8)
+            for i, (start, stop) in enumerate(zip(spacing, spacing[1:])):
+                chars[:, start + i:stop + i] = bits[:, start:stop]
+        else:
+            width = 33
+            chars = np.empty((len(words), width), dtype=np.uint8)
+            chars[:, :32] = bits
+        chars[:, -1] = ord('\t')
+        text = chars.tobytes().decode()
+        return [text[i:i + width] for i in range(0, len(text), width)]
+
+    def __format_lines(self, first, last):
+        """
+        Formats the _dis.txt lines of a range of instructions from the field columns, one pass per format
+        :param first: The index of the first instruction
+        :param last: The index after the last instruction
+        :return: The text of the lines
+        """
+        table = self.__table
+        format_column = table['format'][first:last]
+        name_column = table['name'][first:last]
+        names = np.array(self.__names, dtype=object)
+        shifts = np.isin(name_column, [self.__names.index(name) for name in ('LSL', 'LSR', 'ASR')
+                                       if name in self.__names])
+
+        operands = np.empty(last - first, dtype=object)
+        for format_code, inst_format in enumerate(BatchDisassembler.formats):
+            selected = format_column == format_code
+            groups = [(inst_format, selected)]
+            if inst_format == 'R':
+                groups = [('R', selected & ~shifts), ('shift', selected & shifts)]
+            for key, mask in groups:
+                rows = np.flatnonzero(mask)
+                if not len(rows):
+                    continue
+                template, fields = BatchDisassembler.templates[key]
+                layout = table['fields'].get(inst_format, {})
+                columns = [layout[field][first:last][rows] for field in fields]
+                if inst_format == 'IM':
+                    columns[-1] = columns[-1] * 16
+                operands[rows] = list(map(template.format, table['address'][first:last][rows].tolist(),
+                                          names[name_column[rows]].tolist(), *[c.tolist() for c in columns]))
+
+        binary = BatchDisassembler.binary_strings(table['word'][first:last], True)
+        return '\n'.join(map(str.__add__, binary, operands.tolist())) + '\n'
+
+    def __write_output(self):
+        """
+        Writes the _dis.txt output in the same format as Disassembler
+        """
+        table = self.__table
+        chunk = BatchDisassembler.chunk_words
+        with TraceWriter(self.__output_file + '_dis.txt', self.__compression) as out_file:
+            for first in range(0, len(table['word']), chunk):
+                out_file.write(self.__format_lines(first, min(first + chunk, len(table['word']))))
+            for first in range(0, len(table['data']), chunk):
+                data = table['data'][first:first + chunk]
+                binary = BatchDisassembler.binary_strings(data.astype(np.uint32), False)
+                out_file.write(''.join(map('{}{}\t{}\n'.format, binary,
+                                           table['data_address'][first:first + chunk].tolist(), data.tolist())))
@@ -0,0 +1,190 @@
+import io
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from Disassembler import Disassembler
+from DisassemblyCache import DisassemblyCache
+from team13_project2 import Simulator
+
+
+class JobTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise JobTimeout()
+
+
+def run_job(infile, outfile, options):
+    """
+    Disassembles and simulates one input. Runs inside a worker process, so errors are reported in the result
+    instead of ending the process.
+    :param infile: The input file.
+    :param outfile: The output prefix for the _dis.txt and _sim.txt files.
+    :param options: A dictionary with 'timeout', 'trace_interval', 'compression', 'input_format', 'cache_dir' and
+    'buffer_size'.
+    :return: A dictionary with the input, output, status ('ok', 'error' or 'timeout'), cycles, seconds and message.
+    """
+    result = {'input': infile, 'output': outfile, 'status': 'ok', 'cycles': 0, 'seconds': 0.0, 'message': ''}
+    stderr = sys.stderr
+    sys.stderr = io.StringIO()
+    timeout = options.get('timeout')
+    if timeout and hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    start = time.time()
+    try:
+        compression = options.get('compression')
+        input_format = options.get('input_format', 'text')
+        processed_inst, processed_data = DisassemblyCache.disassemble(
+            lambda: Disassembler(infile, outfile, compression, input_format), infile, outfile, compression,
+            input_format, options.get('cache_dir'))
+        s = Simulator(processed_inst, processed_data, outfile, compression=compression)
+        result['cycles'] = s.run(options.get('trace_interval', 1), buffer_size=options.get('buffer_size'))
+    except JobTimeout:
+        result['status'] = 'timeout'
+        result['message'] = 'ERROR: Timed out after {}s'.format(timeout)
+    except SystemExit:
+        # Disassembler and Simulator print the error and quit
+        result['status'] = 'error'
+        result['message'] = sys.stderr.getvalue().strip()
+    except Exception as e:
+        result['status'] = 'error'
+        result['message'] = 'ERROR: {}: {}'.format(type(e).__name__, e)
+    finally:
+        if timeout and hasattr(signal, 'SIGALRM'):
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        sys.stderr = stderr
+        result['seconds'] = time.time() - start
+    return result
+
+
+class BatchRunner:
+    """
+    Runs disassembly and simulation for many inputs on a pool of worker processes, so a regression run pays for
+    interpreter startup once per worker instead of once per program.
+    """
+
+    def __init__(self, inputs, output_dir, workers=None, timeout=None, trace_interval=1, compression=None,
+                 input_format='text', cache_dir=None):
+        self.__inputs = inputs
+        self.__output_dir = output_dir
+        self.__workers = workers
+        self.__options = {
+            'timeout': timeout,
+            'trace_interval': trace_interval,
+            'compression': compression,
+            'input_format': input_format,
+            'cache_dir': cache_dir
+        }
+        self.__results = []
+
+    @staticmethod
+    def read_inputs(directory=None, manifest=None):
+        """
+        Collects the inputs of a batch.
+        :param directory: A directory whose regular files are all inputs.
+        :param manifest: A file listing one input path per line, relative to the manifest. Blank lines and lines
+        starting with '#' are skipped.
+        :return: A sorted list of input paths.
+        """
+        inputs = []
+        if directory:
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    inputs.append(path)
+        if manifest:
+            base = os.path.dirname(manifest)
+            with open(manifest, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        inputs.append(os.path.join(base, line))
+        return sorted(inputs)
+
+    def run(self):
+        """
+        Runs every input and writes summary.txt to the output directory.
+        :return: The list of job results, in input order.
+        """
+        if not os.path.isdir(self.__output_dir):
+            os.makedirs(self.__output_dir)
+
+        with ProcessPoolExecutor(max_workers=self.__workers) as pool:
+            futures = []
+            for infile in self.__inputs:
+                stem = os.path.splitext(os.path.basename(infile))[0]
+                outfile = os.path.join(self.__output_dir, stem)
+                futures.append(pool.submit(run_job, infile, outfile, self.__options))
+            self.__results = [f.result() for f in futures]
+
+        with open(os.path.join(self.__output_dir, 'summary.txt'), 'w') as f:
+            f.write(self.summary())
+        return self.__results
+
+    def summary(self):
+        """
+        Returns a report with one line per job and the totals.
+        :return: The summary text.
+        """
+        out = 'status\tcycles\tseconds\tinput\tmessage\n'
+        counts = {}
+        for r in self.__results:
+            counts[r['status']] = counts.get(r['status'], 0) + 1
+            out += '{}\t{}\t{:.3f}\t{}\t{}\n'.format(r['status'], r['cycles'], r['seconds'], r['input'], r['message'])
+        out += '\ntotal:{}'.format(len(self.__results))
+        for status in ('ok', 'error', 'timeout'):
+            out += '\t{}:{}'.format(status, counts.get(status, 0))
+        out += '\tcycles:{}\tseconds:{:.3f}\n'.format(sum(r['cycles'] for r in self.__results),
+                                                     sum(r['seconds'] for r in self.__results))
+        return out
+
+
+if __name__ == '__main__':
+    directory = None
+    manifest = None
+    outdir = ''
+    workers = None
+    timeout = None
+    trace_interval = 1
+    compression = None
+    input_format = 'text'
+    cache_dir = None
+
+    # Get inputs and options from command line arguments
+    for i in range(len(sys.argv)):
+        if sys.argv[i] == '-d':
+            # Run every file in a directory
+            directory = sys.argv[i + 1]
+        elif sys.argv[i] == '-m':
+            # Run every file listed in a manifest
+            manifest = sys.argv[i + 1]
+        elif sys.argv[i] == '-o':
+            outdir = sys.argv[i + 1]
+        elif sys.argv[i] == '-w':
+            # Number of worker processes, defaults to the number of cores
+            workers = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-t':
+            # Per-job timeout in seconds
+            timeout = float(sys.argv[i + 1])
+        elif sys.argv[i] == '-f':
+            trace_interval = 0
+        elif sys.argv[i] == '-n':
+            trace_interval = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-z':
+            compression = sys.argv[i + 1]
+        elif sys.argv[i] == '-b':
+            input_format = sys.argv[i + 1]
+        elif sys.argv[i] == '-C':
+            # Reuse disassemblies of unchanged inputs from a cache directory
+            cache_dir = sys.argv[i + 1]
+
+    b = BatchRunner(BatchRunner.read_inputs(directory, manifest), outdir, workers, timeout, trace_interval,
+                    compression, input_format, cache_dir)
+    b.run()
+    sys.stdout.write(b.summary())
@@ -0,0 +1,355 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from Disassembler import Disassembler
+from BatchDisassembler import BatchDisassembler, np
+from team13_project2 import Simulator
+
+
+def encode(name, **fields):
+    """
+    Encodes one instruction from its name and fields, using the same opcode table and field layouts the
+    disassembler decodes with
+    :param name: The instruction name, e.g. 'ADDI'
+    :param fields: The values of the format's fields other than the opcode
+    :return: The 32-bit instruction word
+    """
+    for (low, high), (inst_format, inst_name) in Disassembler.opcode_dict.items():
+        if inst_name == name:
+            break
+    else:
+        raise ValueError('ERROR: Unknown instruction \'{}\''.format(name))
+    if inst_format == 'BREAK':
+        return Disassembler.break_inst
+
+    word = 0
+    for field, high_bit, low_bit, _ in Disassembler.field_layouts.get(inst_format, ()):
+        width = high_bit - low_bit + 1
+        # opcode_dict holds 11-bit opcodes, shorter opcode fields are their high bits
+        val = low >> (11 - width) if field == 'opcode' else fields.get(field, 0)
+        word |= (val & ((1 << width) - 1)) << low_bit
+    return word
+
+
+def load_constant(rd, value):
+    """
+    Encodes the MOVZ/MOVK sequence loading a 32-bit constant into a register
+    :param rd: The register
+    :param value: The constant
+    :return: A list of instruction words
+    """
+    words = [encode('MOVZ', rd=rd, immediate=value & 0xFFFF, shift=0)]
+    if value >> 16:
+        words.append(encode('MOVK', rd=rd, immediate=(value >> 16) & 0xFFFF, shift=1))
+    return words
+
+
+class Benchmark:
+    """
+    Generates synthetic programs, times Disassembler.run and Simulator.run on them in each output mode and compares
+    the results with a stored baseline. Rates are instructions (or input words, for disassembly) per second, and
+    peak memory is measured with tracemalloc in a separate run so it does not slow down the timed one.
+    """
+    # workload name : description
+    workloads = {
+        'loop': 'counted ALU loop',
+        'memory': 'LDUR/ADDI/STUR stream over a data array',
+        'branch': 'loop with a data-dependent branch every iteration',
+        'straight': 'long straight-line ALU code',
+        'data': 'short program with a large data segment'
+    }
+
+    # mode : (Simulator options, trace_interval), None for the disassembly modes
+    modes = {
+        'dis': None,
+        'dis-batch': None,
+        'trace': ({'jit': False}, 1),
+        'sampled': ({'jit': False}, 1000),
+        'final': ({'jit': False}, 0),
+        'jit': ({'jit': True}, 0)
+    }
+
+    def __init__(self, scale=1.0, workloads=None, modes=None, repeat=1, measure_memory=True, work_dir=None):
+        self.__scale = scale
+        self.__workloads = workloads or list(Benchmark.workloads)
+        # The batch disassembler needs NumPy, so it is only run by default when NumPy is installed
+        self.__modes = modes or [mode for mode in Benchmark.modes if mode != 'dis-batch' or np is not None]
+        self.__repeat = repeat
+        self.__measure_memory = measure_memory
+        self.__work_dir = work_dir
+
+        # workload : mode : {'seconds', 'count', 'rate', 'peak_kb'}
+        self.__results = {}
+
+    @staticmethod
+    def generate(workload, scale=1.0):
+        """
+        Generates the instruction and data words of a synthetic program
+        :param workload: The workload name
+        :param scale: Multiplies the number of iterations, instructions or data words
+        :return: A tuple of the instruction words (ending with BREAK) and the data words
+        """
+        data = []
+        if workload == 'loop':
+            # X1 counts down, X2 accumulates
+            n = max(1, int(100000 * scale))
+            words = load_constant(1, n) + [
+                encode('ADD', rd=2, rn=2, rm=1),
+                encode('EOR', rd=3, rn=2, rm=1),
+                encode('SUBI', rd=1, rn=1, immediate=1),
+                encode('CBNZ', rt=1, offset=-3)
+            ]
+        elif workload == 'memory':
+            # X1 counts the passes over a 64-word array at X3, each word is loaded, incremented and stored back
+            n = max(1, int(100 * scale))
+            words = load_constant(1, n)
+            # The data section follows the 10 instructions below and the BREAK
+            start = 96 + 4 * (len(words) + 11)
+            words += [
+                encode('MOVZ', rd=3, immediate=start),
+                encode('MOVZ', rd=4, immediate=64),
+                encode('LDUR', rt=5, rn=3, offset=0),
+                encode('ADDI', rd=5, rn=5, immediate=1),
+                encode('STUR', rt=5, rn=3, offset=0),
+                encode('ADDI', rd=3, rn=3, immediate=4),
+                encode('SUBI', rd=4, rn=4, immediate=1),
+                encode('CBNZ', rt=4, offset=-5),
+                encode('SUBI', rd=1, rn=1, immediate=1),
+                encode('CBNZ', rt=1, offset=-9)
+            ]
+            data = list(range(64))
+        elif workload == 'branch':
+            # X1 counts down, X8 and X9 count the odd and even iterations
+            n = max(1, int(50000 * scale))
+            words = load_constant(1, n) + [
+                encode('MOVZ', rd=7, immediate=1),
+                encode('AND', rd=6, rn=1, rm=7),
+                encode('CBZ', rt=6, offset=3),
+                encode('ADDI', rd=8, rn=8, immediate=1),
+                encode('B', offset=2),
+                encode('ADDI', rd=9, rn=9, immediate=1),
+                encode('SUBI', rd=1, rn=1, immediate=1),
+                encode('CBNZ', rt=1, offset=-6)
+            ]
+        elif workload == 'straight':
+            n = max(1, int(50000 * scale))
+            ops = [('ADD', {'rm': 2}), ('SUB', {'rm': 3}), ('ORR', {'rm': 4}), ('ADDI', {'immediate': 5}),
+                   ('ASR', {'shamt': 1}), ('EOR', {'rm': 1})]
+            words = []
+            for k in range(n):
+                name, fields = ops[k % len(ops)]
+                words.append(encode(name, rd=1 + k % 8, rn=1 + (k + 3) % 8, **fields))
+        elif workload == 'data':
+            n = max(1, int(100000 * scale))
+            words = [encode('ADDI', rd=1, rn=1, immediate=1)] * 4
+            data = [(k * 2654435761) % 1000003 - 500000 for k in range(n)]
+        else:
+            raise ValueError('ERROR: Unknown workload \'{}\''.format(workload))
+        return words + [Disassembler.break_inst], data
+
+    @staticmethod
+    def write_program(path, words, data):
+        """
+        Writes a program in the text input format, one 32-character binary word per line
+        :param path: The input file to write
+        :param words: The instruction words
+        :param data: The data words, as signed values
+        """
+        with open(path, 'w') as f:
+            for word in words + [val & 0xFFFFFFFF for val in data]:
+                f.write('{0:032b}\n'.format(word))
+
+    def run(self):
+        """
+        Generates every workload and times every mode on it
+        :return: The results, workload : mode : {'seconds', 'count', 'rate', 'peak_kb'}
+        """
+        work_dir = self.__work_dir or tempfile.mkdtemp(prefix='bench')
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+        try:
+            for workload in self.__workloads:
+                infile = os.path.join(work_dir, workload + '.txt')
+                outfile = os.path.join(work_dir, workload)
+                Benchmark.write_program(infile, *Benchmark.generate(workload, self.__scale))
+
+                d = Disassembler(infile, outfile)
+                d.run()
+                processed_inst = d.get_processed_inst()
+                processed_data = d.get_processed_data()
+
+                results = self.__results[workload] = {}
+                for mode in self.__modes:
+                    def job():
+                        return Benchmark.run_mode(mode, infile, outfile, processed_inst, processed_data)
+
+                    best = None
+                    for _ in range(self.__repeat):
+                        start = time.perf_counter()
+                        count = job()
+                        seconds = time.perf_counter() - start
+                        best = seconds if best is None else min(best, seconds)
+                    results[mode] = {'seconds': best, 'count': count, 'rate': count / best if best else 0.0}
+
+                    if self.__measure_memory:
+                        tracemalloc.start()
+                        try:
+                            job()
+                            results[mode]['peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+                        finally:
+                            tracemalloc.stop()
+        finally:
+            if self.__work_dir is None:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        return self.__results
+
+    @staticmethod
+    def run_mode(mode, infile, outfile, processed_inst, processed_data):
+        """
+        Runs one mode once
+        :param mode: The mode name
+        :param infile: The input file, for the disassembly modes
+        :param outfile: The output prefix
+        :param processed_inst: The processed instructions, for the simulation modes
+        :param processed_data: The processed data, for the simulation modes
+        :return: The number of input words disassembled or cycles simulated
+        """
+        if mode == 'dis':
+            d = Disassembler(infile, outfile)
+            d.run()
+            return len(d.get_processed_inst()) + len(d.get_processed_data())
+        elif mode == 'dis-batch':
+            # Converting to processed instructions is part of the batch path, as the Simulator needs them
+            d = BatchDisassembler(infile, outfile)
+            d.run()
+            return len(d.get_processed_inst()) + len(d.get_processed_data())
+        options, trace_interval = Benchmark.modes[mode]
+        s = Simulator(processed_inst, processed_data, outfile, **options)
+        return s.run(trace_interval)
+
+    def get_results(self):
+        return self.__results
+
+    def compare(self, baseline, tolerance=0.1):
+        """
+        Compares the results with a baseline
+        :param baseline: Results of an earlier run, in the form returned by run
+        :param tolerance: The fraction by which a rate may drop, or peak memory grow, before it counts as a regression
+        :return: A list of (workload, mode, metric, baseline value, current value) tuples, one per regression
+        """
+        regressions = []
+        for workload, modes in sorted(self.__results.items()):
+            for mode, result in sorted(modes.items()):
+                base = baseline.get(workload, {}).get(mode)
+                if base is None:
+                    continue
+                if result['rate'] < base['rate'] * (1 - tolerance):
+                    regressions.append((workload, mode, 'rate', base['rate'], result['rate']))
+                if 'peak_kb' in result and 'peak_kb' in base and result['peak_kb'] > base['peak_kb'] * (1 + tolerance):
+                    regressions.append((workload, mode, 'peak_kb', base['peak_kb'], result['peak_kb']))
+        return regressions
+
+    def report(self, baseline=None):
+        """
+        Returns a table of the results, with the change from the baseline when one is given
+        :param baseline: Results of an earlier run, None to leave out the change column
+        :return: The report text
+        """
+        out = 'workload\tmode\tseconds\tcount\trate/s\tpeak_kb\tchange\n'
+        for workload, modes in sorted(self.__results.items()):
+            for mode in self.__modes:
+                result = modes[mode]
+                change = ''
+                base = (baseline or {}).get(workload, {}).get(mode)
+                if base and base['rate']:
+                    change = '{:+.1f}%'.format(100.0 * (result['rate'] / base['rate'] - 1))
+                out += '{}\t{}\t{:.4f}\t{}\t{:.0f}\t{}\t{}\n'.format(workload, mode, result['seconds'],
+                                                                     result['count'], result['rate'],
+                                                                     result.get('peak_kb', ''), change)
+        return out
+
+    def save(self, path):
+        """
+        Writes the results as JSON, e.g. as the baseline of later runs
+        :param path: The JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.__results, f, indent=1, sort_keys=True)
+
+    @staticmethod
+    def load(path):
+        """
+        Reads results written by save
+        :param path: The JSON file
+        :return: The results
+        """
+        with open(path, 'r') as f:
+            return json.load(f)
+
+
+if __name__ == '__main__':
+    scale = 1.0
+    workloads = None
+    modes = None
+    repeat = 1
+    measure_memory = True
+    work_dir = None
+    save = None
+    baseline_file = None
+    tolerance = 0.1
+
+    # Get options from command line arguments
+    for i in range(len(sys.argv)):
+        if sys.argv[i] == '-x':
+            # Scale the size of every workload
+            scale = float(sys.argv[i + 1])
+        elif sys.argv[i] == '-w':
+            # Comma-separated workloads to run
+            workloads = sys.argv[i + 1].split(',')
+        elif sys.argv[i] == '-m':
+            # Comma-separated modes to run
+            modes = sys.argv[i + 1].split(',')
+        elif sys.argv[i] == '-r':
+            # Keep the best of N timed runs
+            repeat = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-M':
+            # Skip the peak memory runs
+            measure_memory = False
+        elif sys.argv[i] == '-o':
+            # Keep the generated programs and outputs in a directory
+            work_dir = sys.argv[i + 1]
+        elif sys.argv[i] == '-s':
+            # Save the results as JSON
+            save = sys.argv[i + 1]
+        elif sys.argv[i] == '-c':
+            # Compare with a baseline saved by -s
+            baseline_file = sys.argv[i + 1]
+        elif sys.argv[i] == '-t':
+            # Allowed slowdown before a result counts as a regression, as a fraction
+            tolerance = float(sys.argv[i + 1])
+
+    for name in (workloads or []):
+        if name not in Benchmark.workloads:
+            print('ERROR: Unknown workload \'{}\''.format(name), file=sys.stderr)
+            quit(2)
+    for name in (modes or []):
+        if name not in Benchmark.modes:
+            print('ERROR: Unknown mode \'{}\''.format(name), file=sys.stderr)
+            quit(2)
+
+    b = Benchmark(scale, workloads, modes, repeat, measure_memory, work_dir)
+    b.run()
+    baseline = Benchmark.load(baseline_file) if baseline_file else None
+    sys.stdout.write(b.report(baseline))
+    if save:
+        b.save(save)
+    if baseline is not None:
+        regressions = b.compare(baseline, tolerance)
+        for workload, mode, metric, before, after in regressions:
+            print('REGRESSION\t{}\t{}\t{}\t{:.0f} -> {:.0f}'.format(workload, mode, metric, before, after))
+        if regressions:
+            quit(1)
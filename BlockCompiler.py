@@ -0,0 +1,199 @@
+class BlockCompiler:
+    """
+    Translates basic blocks of instructions into generated Python functions. Registers are loaded into locals on
+    entry and stored back on exit, and a block whose branch jumps back to its own start loops inside the function.
+    Compiled blocks are cached by start PC until invalidate is called for an address they cover.
+    """
+    branch_types = ('B', 'CB')
+
+    # R-format name : expression computing rd
+    r_ops = {
+        'AND': '{rn} & {rm}',
+        'ADD': '{rn} + {rm}',
+        'ORR': '{rn} | {rm}',
+        'EOR': '{rn} ^ {rm}',
+        'SUB': '{rn} - {rm}',
+        'ASR': '{rn} >> {shamt}',
+        'LSR': '({rn} % 4294967296) >> {shamt}',
+        'LSL': '{rn} << {shamt}'
+    }
+
+    def __init__(self, instructions, registers, read_memory, write_memory, find_leaders=True):
+        self.__instructions = instructions
+        # Without leaders a block only ends at a branch, so blocks may overlap, but no instruction has to be
+        # decoded before it is reached
+        self.__find_leaders_enabled = find_leaders
+        self.__registers = registers
+        self.__read_memory = read_memory
+        self.__write_memory = write_memory
+
+        # start pc : compiled block, None if no block can start there
+        self.__cache = {}
+        # start pc : (first address, last address) covered by the block
+        self.__ranges = {}
+        self.__leaders = None
+
+    def get_block(self, pc):
+        """
+        Returns the compiled block starting at a PC, compiling it on first use.
+        :param pc: The start address of the block.
+        :return: A function running the block and returning (next pc, cycles), or None if pc is not an instruction
+        or is a BREAK.
+        """
+        try:
+            return self.__cache[pc]
+        except KeyError:
+            block = self.__cache[pc] = self.__compile(pc)
+            return block
+
+    def invalidate(self, address=None):
+        """
+        Drops the cached blocks covering an instruction address, or every block.
+        :param address: The address of the instruction that changed, None to drop everything.
+        """
+        self.__leaders = None
+        if address is None:
+            self.__cache.clear()
+            self.__ranges.clear()
+            return
+        for start, (first, last) in list(self.__ranges.items()):
+            if first <= address <= last:
+                del self.__cache[start]
+                del self.__ranges[start]
+        self.__cache.pop(address, None)
+
+    def __find_leaders(self):
+        """
+        Finds the addresses starting a basic block: the first instruction, branch targets and instructions following
+        a branch.
+        :return: A set of leader addresses.
+        """
+        leaders = set()
+        if not self.__find_leaders_enabled:
+            return leaders
+        if self.__instructions:
+            leaders.add(min(self.__instructions.keys()))
+        for address, inst in self.__instructions.items():
+            if inst.type in BlockCompiler.branch_types:
+                leaders.add(address + inst.offset * 4)
+                leaders.add(address + 4)
+        return leaders
+
+    def __collect(self, pc):
+        """
+        Collects the instructions of the basic block starting at a PC. The block ends with a branch, before the next
+        leader, before a BREAK, before a word that can't be decoded or at the end of instruction memory. Words that
+        can't be decoded are left to the interpreter, which reports them when they are reached.
+        :param pc: The start address of the block.
+        :return: The list of instructions in the block.
+        """
+        if self.__leaders is None:
+            self.__leaders = self.__find_leaders()
+        block = []
+        address = pc
+        while address in self.__instructions:
+            try:
+                inst = self.__instructions[address]
+            except ValueError:
+                break
+            if inst.type == 'BREAK' or (block and address in self.__leaders):
+                break
+            block.append(inst)
+            if inst.type in BlockCompiler.branch_types:
+                break
+            address += 4
+        return block
+
+    def __compile(self, pc):
+        """
+        Generates and compiles the Python function for the block starting at a PC.
+        :param pc: The start address of the block.
+        :return: The compiled block, or None if the block is empty.
+        """
+        block = self.__collect(pc)
+        if not block:
+            return None
+
+        body = []
+        used = set()
+        written = set()
+
+        def reg(r):
+            used.add(r)
+            return 'r{}'.format(r)
+
+        def assign(r, expr):
+            written.add(r)
+            body.append('{} = {}'.format(reg(r), expr))
+
+        for inst in block:
+            name = inst.name
+            if inst.type == 'R':
+                assign(inst.rd, BlockCompiler.r_ops[name].format(rn=reg(inst.rn), rm=reg(inst.rm), shamt=inst.shamt))
+            elif inst.type == 'I':
+                op = '-' if name == 'SUBI' else '+'
+                assign(inst.rd, '{} {} {}'.format(reg(inst.rn), op, inst.immediate))
+            elif inst.type == 'D':
+                address = '{} + {}'.format(reg(inst.rn), 4 * inst.offset)
+                if name == 'STUR':
+                    body.append('write_memory({}, {})'.format(address, reg(inst.rt)))
+                elif name == 'LDUR':
+                    assign(inst.rt, 'read_memory({})'.format(address))
+            elif inst.type == 'IM':
+                val = inst.immediate << (inst.shift * 16)
+                if name == 'MOVZ':
+                    assign(inst.rd, str(val))
+                else:
+                    mask = (0x000000000000FFFF << (inst.shift * 16)) ^ 0xFFFFFFFFFFFFFFFF
+                    assign(inst.rd, '({} & {}) | {}'.format(reg(inst.rd), mask, val))
+
+        last = block[-1]
+        end = last.address + 4
+        cycles = len(block)
+        store = ['regs[{0}] = r{0}'.format(r) for r in sorted(written)]
+        exit_lines = store + ['return {}, cycles'.format('{exit}')]
+
+        if last.type == 'B':
+            target = last.address + last.offset * 4
+            loops = target == pc
+            condition = None
+        elif last.type == 'CB':
+            target = last.address + last.offset * 4
+            loops = target == pc
+            condition = '{} {} 0'.format(reg(last.rt), '==' if last.name == 'CBZ' else '!=')
+        else:
+            target = end
+            loops = False
+            condition = None
+
+        lines = ['def block():']
+        lines += ['    r{0} = regs[{0}]'.format(r) for r in sorted(used)]
+        lines.append('    cycles = 0')
+        indent = '    '
+        if loops:
+            lines.append('    while True:')
+            indent = '        '
+        lines += [indent + line for line in body]
+        lines.append(indent + 'cycles += {}'.format(cycles))
+
+        if loops and condition is None:
+            # Unconditional branch to itself never exits, matching the interpreter
+            pass
+        elif loops:
+            lines.append(indent + 'if not ({}):'.format(condition))
+            lines += [indent + '    ' + line.format(exit=end) for line in exit_lines]
+        elif condition is not None:
+            lines.append(indent + 'if {}:'.format(condition))
+            lines += [indent + '    ' + line.format(exit=target) for line in exit_lines]
+            lines += [indent + line.format(exit=end) for line in exit_lines]
+        else:
+            lines += [indent + line.format(exit=target) for line in exit_lines]
+
+        namespace = {
+            'regs': self.__registers,
+            'read_memory': self.__read_memory,
+            'write_memory': self.__write_memory
+        }
+        exec(compile('\n'.join(lines) + '\n', '<block {}>'.format(pc), 'exec'), namespace)
+        self.__ranges[pc] = (pc, last.address)
+        return namespace['block']
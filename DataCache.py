@@ -0,0 +1,84 @@
+class DataCache:
+    """
+    Set-associative data cache with LRU replacement, write-back and write-allocate. Only the tags are kept: values
+    stay in Memory, so the cache decides how long an access takes and never what it returns.
+    """
+
+    def __init__(self, size=1024, line=16, ways=2):
+        if line < 4 or line & (line - 1):
+            raise ValueError('ERROR: Cache line size must be a power of two of at least 4 bytes, not {}'.format(line))
+        if ways < 1 or size <= 0 or size % (line * ways):
+            raise ValueError('ERROR: Cache size {} is not a multiple of {} ways of {} bytes'.format(size, ways, line))
+        self.size = size
+        self.line = line
+        self.ways = ways
+        self.num_sets = size // (line * ways)
+
+        # one dictionary per set of tag : dirty, least recently used first
+        self.__sets = [{} for _ in range(self.num_sets)]
+
+        self.load_hits = 0
+        self.load_misses = 0
+        self.store_hits = 0
+        self.store_misses = 0
+        self.writebacks = 0
+
+    def access(self, address, write=False):
+        """
+        Looks up the line holding an address, loading it on a miss and evicting the least recently used line of
+        its set when the set is full.
+        :param address: The byte address.
+        :param write: True for a store, which marks the line dirty.
+        :return: True on a hit, False on a miss.
+        """
+        block = address // self.line
+        entries = self.__sets[block % self.num_sets]
+        tag = block // self.num_sets
+
+        dirty = entries.pop(tag, None)
+        hit = dirty is not None
+        if not hit:
+            dirty = False
+            if len(entries) == self.ways:
+                victim = next(iter(entries))
+                if entries.pop(victim):
+                    self.writebacks += 1
+        entries[tag] = dirty or write
+
+        if write:
+            if hit:
+                self.store_hits += 1
+            else:
+                self.store_misses += 1
+        elif hit:
+            self.load_hits += 1
+        else:
+            self.load_misses += 1
+        return hit
+
+    @staticmethod
+    def hit_rate(hits, misses):
+        """
+        Returns a hit rate in percent.
+        :param hits: The number of hits.
+        :param misses: The number of misses.
+        :return: The percentage of accesses that hit, 0 without accesses.
+        """
+        return 100.0 * hits / (hits + misses) if hits + misses else 0.0
+
+    def to_dict(self):
+        """
+        Returns the geometry and counters in a JSON-serializable form.
+        :return: A dictionary of the counters.
+        """
+        return {
+            'size': self.size,
+            'line': self.line,
+            'ways': self.ways,
+            'sets': self.num_sets,
+            'load_hits': self.load_hits,
+            'load_misses': self.load_misses,
+            'store_hits': self.store_hits,
+            'store_misses': self.store_misses,
+            'writebacks': self.writebacks
+        }
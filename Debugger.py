@@ -0,0 +1,291 @@
+import sys
+from collections import deque
+from team13_project2 import Simulator
+
+
+class Debugger:
+    """
+    Time-travel debugger over a Simulator. Every cycle run through the debugger adds an undo record of the
+    registers and memory words it wrote, taken from the simulator's write hooks, so stepping backwards undoes one
+    record. Undo records are kept in a ring buffer of history cycles, and a full snapshot of the state is taken
+    every snapshot_interval cycles and kept in a ring buffer of max_snapshots. Going back past the oldest undo
+    record restores the nearest earlier snapshot and runs forward again, which gives the same states since the
+    simulation is deterministic. The state the debugger started from is kept outside the ring buffer, so every
+    earlier cycle stays reachable, at the cost of a longer replay once its snapshots were evicted.
+
+    Breakpoints stop before the instruction at a PC runs. Watchpoints on registers and memory addresses stop after
+    a cycle writing them going forwards, and before it going backwards.
+    """
+
+    def __init__(self, simulator, snapshot_interval=1024, max_snapshots=32, history=1 << 16):
+        self.__simulator = simulator
+        self.__snapshot_interval = snapshot_interval
+
+        # (pc, cycle) before each cycle with its register writes (register, old, new) and memory writes (address,
+        # old, new, max_address before the write)
+        self.__log = deque(maxlen=history)
+        self.__snapshots = deque(maxlen=max_snapshots)
+        self.__registers = []
+        self.__memory = []
+        self.__halted = False
+
+        self.breakpoints = set()
+        self.watched_registers = set()
+        self.watched_addresses = set()
+
+        simulator.set_hooks(self)
+        self.__initial = simulator.get_state()
+        self.__initial['halted'] = False
+
+    def register_written(self, r, old, new):
+        """
+        Hook called by the simulator before a register write.
+        :param r: The register.
+        :param old: Its value before the write.
+        :param new: The value written.
+        """
+        self.__registers.append((r, old, new))
+
+    def memory_written(self, a, old, new):
+        """
+        Hook called by the simulator before a memory write.
+        :param a: The memory address.
+        :param old: The word there before the write.
+        :param new: The value written.
+        """
+        self.__memory.append((a, old, new, self.__simulator.get_memory().max_address))
+
+    def __snapshot(self):
+        """
+        Adds a snapshot of the current state, unless one of this cycle was already taken.
+        """
+        cycle = self.__simulator.get_cycle()
+        last = self.__snapshots[-1] if self.__snapshots else self.__initial
+        if last['cycle'] < cycle:
+            state = self.__simulator.get_state()
+            state['halted'] = self.__halted
+            self.__snapshots.append(state)
+
+    def step(self):
+        """
+        Runs one cycle.
+        :return: Why execution should stop after it, None if nothing was hit.
+        """
+        if self.__halted:
+            return 'halted'
+        simulator = self.__simulator
+        pc = simulator.get_pc()
+        cycle = simulator.get_cycle()
+        self.__registers = []
+        self.__memory = []
+        self.__halted = simulator.step()
+        self.__log.append((pc, cycle, self.__registers, self.__memory))
+        if not simulator.get_cycle() % self.__snapshot_interval:
+            self.__snapshot()
+
+        for r, old, new in self.__registers:
+            if r in self.watched_registers:
+                return 'register R{} changed from {} to {}'.format(r, old, new)
+        for a, old, new, _ in self.__memory:
+            if a in self.watched_addresses:
+                return 'memory {} changed from {} to {}'.format(a, old, new)
+        if self.__halted:
+            return 'halted'
+        if simulator.get_pc() in self.breakpoints:
+            return 'breakpoint {}'.format(simulator.get_pc())
+        return None
+
+    def step_back(self):
+        """
+        Undoes the last cycle.
+        :return: Why execution should stop before it, None if nothing was hit.
+        """
+        simulator = self.__simulator
+        if not self.__log:
+            # Rebuild the undo records up to the current cycle from an earlier snapshot
+            cycle = simulator.get_cycle()
+            if cycle == self.__initial['cycle']:
+                return 'start of program'
+            self.__rewind(cycle - 1)
+            while simulator.get_cycle() < cycle:
+                self.step()
+
+        pc, cycle, registers, memory = self.__log.pop()
+        regs = simulator.get_registers()
+        for r, old, _ in reversed(registers):
+            regs[r] = old
+        mem = simulator.get_memory()
+        for a, old, _, max_address in reversed(memory):
+            mem.write(a, old)
+            mem.max_address = max_address
+        simulator.set_position(pc, cycle)
+        self.__halted = False
+
+        for r, old, new in registers:
+            if r in self.watched_registers:
+                return 'register R{} changed from {} to {}'.format(r, old, new)
+        for a, old, new, _ in memory:
+            if a in self.watched_addresses:
+                return 'memory {} changed from {} to {}'.format(a, old, new)
+        if pc in self.breakpoints:
+            return 'breakpoint {}'.format(pc)
+        return None
+
+    def forward(self, limit=None):
+        """
+        Runs until a breakpoint, a watchpoint or the end of the program.
+        :param limit: The most cycles to run, None for no limit.
+        :return: Why execution stopped, None if the limit was reached.
+        """
+        n = 0
+        while limit is None or n < limit:
+            reason = self.step()
+            if reason is not None:
+                return reason
+            n += 1
+        return None
+
+    def backward(self, limit=None):
+        """
+        Runs backwards until a breakpoint, a watchpoint or the start of the program.
+        :param limit: The most cycles to undo, None for no limit.
+        :return: Why execution stopped, None if the limit was reached.
+        """
+        n = 0
+        while limit is None or n < limit:
+            if self.__simulator.get_cycle() == self.__initial['cycle']:
+                return 'start of program'
+            reason = self.step_back()
+            if reason is not None:
+                return reason
+            n += 1
+        return None
+
+    def goto(self, cycle):
+        """
+        Moves to the state after a cycle, ignoring breakpoints and watchpoints.
+        :param cycle: The cycle, 0 for the start of the program.
+        """
+        simulator = self.__simulator
+        if cycle < self.__initial['cycle']:
+            raise ValueError('ERROR: Cycle {} is before the start of the debugging session'.format(cycle))
+
+        if self.__log and cycle >= self.__log[0][1]:
+            while simulator.get_cycle() > cycle:
+                self.step_back()
+        elif cycle < simulator.get_cycle():
+            self.__rewind(cycle)
+
+        while simulator.get_cycle() < cycle and not self.__halted:
+            self.step()
+
+    def __rewind(self, cycle):
+        """
+        Restores the latest snapshot taken at or before a cycle, or the starting state, dropping the undo records.
+        :param cycle: The cycle, at least the starting cycle.
+        """
+        state = self.__initial
+        for snapshot in reversed(self.__snapshots):
+            if snapshot['cycle'] <= cycle:
+                state = snapshot
+                break
+        self.__simulator.set_state(state)
+        self.__halted = state['halted']
+        self.__log.clear()
+
+    def is_halted(self):
+        """
+        Returns whether the program has run its BREAK.
+        :return: True at the end of the program.
+        """
+        return self.__halted
+
+    def get_simulator(self):
+        return self.__simulator
+
+
+if __name__ == '__main__':
+    infile = ''
+    input_format = 'text'
+    snapshot_interval = 1024
+    max_snapshots = 32
+    history = 1 << 16
+
+    # Get options from command line arguments
+    for i in range(len(sys.argv)):
+        if sys.argv[i] == '-i':
+            infile = sys.argv[i + 1]
+        elif sys.argv[i] == '-b':
+            # Input is a raw binary image (le or be)
+            input_format = sys.argv[i + 1]
+        elif sys.argv[i] == '-x':
+            # Cycles between snapshots
+            snapshot_interval = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-m':
+            # Snapshots kept
+            max_snapshots = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-H':
+            # Cycles of undo records kept
+            history = int(sys.argv[i + 1])
+
+    try:
+        s = Simulator.from_image(infile, None, input_format, jit=False)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        quit()
+    debugger = Debugger(s, snapshot_interval, max_snapshots, history)
+
+    commands = 's [N]: step, bs [N]: step back, c: continue, rc: reverse continue, g CYCLE: go to cycle, ' \
+               'b PC / db PC: set / delete breakpoint, w R5 / w ADDR: watch register / address, ' \
+               'dw R5 / dw ADDR: delete watchpoint, p: print state, q: quit'
+    print(commands)
+    while True:
+        try:
+            inst = s.get_instruction(s.get_pc())
+        except ValueError:
+            inst = None
+        print('cycle:{}\tpc:{}\t{}'.format(s.get_cycle(), s.get_pc(), inst.assembly if inst else ''))
+        try:
+            words = input('> ').split()
+        except EOFError:
+            break
+        if not words:
+            continue
+        cmd = words[0]
+        arg = words[1] if len(words) > 1 else None
+        try:
+            reason = None
+            if cmd == 's':
+                reason = debugger.forward(int(arg) if arg else 1)
+            elif cmd == 'bs':
+                reason = debugger.backward(int(arg) if arg else 1)
+            elif cmd == 'c':
+                reason = debugger.forward()
+            elif cmd == 'rc':
+                reason = debugger.backward()
+            elif cmd == 'g':
+                debugger.goto(int(arg))
+            elif cmd in ('b', 'db'):
+                if cmd == 'b':
+                    debugger.breakpoints.add(int(arg))
+                else:
+                    debugger.breakpoints.discard(int(arg))
+            elif cmd in ('w', 'dw'):
+                if arg[0] in 'rR':
+                    watched, key = debugger.watched_registers, int(arg[1:])
+                else:
+                    watched, key = debugger.watched_addresses, int(arg)
+                if cmd == 'w':
+                    watched.add(key)
+                else:
+                    watched.discard(key)
+            elif cmd == 'p':
+                print(s.registers_to_string() + '\n' + s.memory_to_string(), end='')
+            elif cmd == 'q':
+                break
+            else:
+                print(commands)
+            if reason is not None:
+                print(reason)
+        except (TypeError, ValueError) as e:
+            print(e if str(e).startswith('ERROR') else 'ERROR: Invalid argument for \'{}\''.format(cmd))
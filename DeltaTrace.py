@@ -0,0 +1,373 @@
+import bisect
+import pickle
+import struct
+import sys
+import zlib
+from array import array
+from Memory import Memory
+from StateRenderer import StateRenderer
+
+# file signature, at the start and at the end after the footer offset
+magic = b'T13DLT01'
+
+# codes of the write column besides register numbers
+no_write = -1
+memory_write = -2
+
+
+class DeltaTraceWriter:
+    """
+    Records every cycle of a Simulator to a binary trace of deltas instead of full states. Cycles are stored in
+    chunks of keyframe_interval cycles; each chunk holds a keyframe with the full state before its first cycle and
+    columns for its cycles: the instruction executed, the register written (or a memory write), and the written
+    values and memory addresses for the cycles that write something. Chunks are compressed with zlib, and the file
+    ends with an index of the first cycle and offset of every chunk, so any cycle is found with a binary search and
+    at most one chunk of replay.
+
+    Values and addresses that do not fit in 64 bits are stored zero in their column and kept exactly beside it.
+    """
+    keyframe_interval = 1 << 14
+
+    def __init__(self, registers, memory, data_begin, keyframe_interval=None):
+        self.__registers = registers
+        self.__memory = memory
+        self.__data_begin = data_begin
+        self.__keyframe_interval = keyframe_interval or DeltaTraceWriter.keyframe_interval
+        self.__file = None
+
+        # (address, assembly) of each wrapped instruction, referred to by index from the instruction column
+        self.__instructions = []
+
+        self.__first_cycles = array('q')
+        self.__offsets = array('q')
+        self.__cycle = 0
+
+    def __start_chunk(self, cycle):
+        """
+        Takes the keyframe of a new chunk from the current state and empties the columns.
+        :param cycle: The number of cycles run before the chunk.
+        """
+        self.__cycle = cycle
+        # Words never written read as 0, so only the non-zero words are kept
+        addresses = array('q')
+        values = array('q')
+        exact = {}
+        for address, value in self.__memory.items():
+            if value:
+                try:
+                    addresses.append(address)
+                    values.append(value)
+                except OverflowError:
+                    del addresses[len(values):]
+                    exact[address] = value
+        self.__keyframe = {
+            'registers': list(self.__registers),
+            'addresses': addresses.tobytes(),
+            'values': values.tobytes(),
+            'exact': exact,
+            'max_address': self.__memory.max_address
+        }
+        self.__insts = array('I')
+        self.__writes = array('h')
+        self.__values = array('q')
+        self.__addresses = array('q')
+        self.__exact_values = {}
+        self.__exact_addresses = {}
+
+    def open(self, path, cycle=0):
+        """
+        Starts writing a trace.
+        :param path: The trace file.
+        :param cycle: The number of cycles already run, e.g. when resuming from a checkpoint.
+        """
+        self.__file = open(path, 'wb')
+        self.__file.write(magic)
+        del self.__first_cycles[:]
+        del self.__offsets[:]
+        self.__start_chunk(cycle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def wrap(self, step, inst):
+        """
+        Wraps the step function of an instruction with the recording of its cycle.
+        :param step: The step function returning the next PC.
+        :param inst: The Instruction it performs.
+        :return: A step function with the same behaviour that also records the cycle.
+        """
+        index = len(self.__instructions)
+        self.__instructions.append((inst.address, inst.assembly))
+        registers = self.__registers
+        read_memory = self.__memory.read
+        record = self.__record
+        dest = inst.operands()[1]
+
+        if inst.name == 'STUR':
+            rn = inst.rn
+            offset = 4 * inst.offset
+
+            def recorded():
+                address = registers[rn] + offset
+                next_pc = step()
+                record(index, memory_write, read_memory(address), address)
+                return next_pc
+        elif dest is not None:
+            def recorded():
+                next_pc = step()
+                record(index, dest, registers[dest])
+                return next_pc
+        else:
+            def recorded():
+                next_pc = step()
+                record(index, no_write)
+                return next_pc
+        return recorded
+
+    def __record(self, index, write, value=0, address=0):
+        """
+        Adds one cycle to the current chunk, writing the chunk once it holds keyframe_interval cycles.
+        :param index: The index of the instruction executed.
+        :param write: The register written, no_write or memory_write.
+        :param value: The value written.
+        :param address: The memory address written.
+        """
+        if self.__file is None:
+            return
+        self.__insts.append(index)
+        self.__writes.append(write)
+        if write != no_write:
+            try:
+                self.__values.append(value)
+            except OverflowError:
+                self.__exact_values[len(self.__values)] = value
+                self.__values.append(0)
+        if write == memory_write:
+            try:
+                self.__addresses.append(address)
+            except OverflowError:
+                self.__exact_addresses[len(self.__addresses)] = address
+                self.__addresses.append(0)
+        if len(self.__insts) >= self.__keyframe_interval:
+            self.__flush_chunk()
+
+    def __flush_chunk(self, last=False):
+        """
+        Compresses the current chunk, appends it to the file and adds it to the index.
+        :param last: True when no chunk follows, so no keyframe is taken for the next one.
+        """
+        if not self.__insts:
+            return
+        chunk = {
+            'keyframe': self.__keyframe,
+            'insts': self.__insts.tobytes(),
+            'writes': self.__writes.tobytes(),
+            'values': self.__values.tobytes(),
+            'addresses': self.__addresses.tobytes(),
+            'exact_values': self.__exact_values,
+            'exact_addresses': self.__exact_addresses
+        }
+        self.__first_cycles.append(self.__cycle + 1)
+        self.__offsets.append(self.__file.tell())
+        self.__file.write(zlib.compress(pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL)))
+        self.__cycle += len(self.__insts)
+        if not last:
+            self.__start_chunk(self.__cycle)
+
+    def close(self):
+        """
+        Writes the last chunk, the instruction table and the index, then closes the file.
+        """
+        if self.__file is not None:
+            try:
+                self.__flush_chunk(True)
+                footer = {
+                    'data_begin': self.__data_begin,
+                    'instructions': self.__instructions,
+                    'first_cycles': self.__first_cycles.tobytes(),
+                    'offsets': self.__offsets.tobytes(),
+                    'last_cycle': self.__cycle
+                }
+                offset = self.__file.tell()
+                self.__file.write(zlib.compress(pickle.dumps(footer, pickle.HIGHEST_PROTOCOL)))
+                self.__file.write(struct.pack('<Q', offset) + magic)
+            finally:
+                self.__file.close()
+                self.__file = None
+
+
+class DeltaTraceReader:
+    """
+    Reads a trace written by DeltaTraceWriter and regenerates the text of the _sim.txt trace for any range of
+    cycles, with the same StateRenderer the Simulator uses.
+    """
+
+    def __init__(self, path):
+        self.__file = open(path, 'rb')
+        self.__file.seek(-len(magic) - 8, 2)
+        tail = self.__file.read()
+        self.__file.seek(0)
+        if self.__file.read(len(magic)) != magic or tail[8:] != magic:
+            self.__file.close()
+            raise ValueError('ERROR: Not a complete delta trace: \'{}\''.format(path))
+        offset = struct.unpack('<Q', tail[:8])[0]
+        self.__file.seek(offset)
+        footer = pickle.loads(zlib.decompress(self.__file.read()[:-len(magic) - 8]))
+
+        self.data_begin = footer['data_begin']
+        self.__instructions = footer['instructions']
+        self.__first_cycles = array('q')
+        self.__first_cycles.frombytes(footer['first_cycles'])
+        self.__offsets = array('q')
+        self.__offsets.frombytes(footer['offsets'])
+        self.__ends = self.__offsets[1:].tolist() + [offset]
+        self.last_cycle = footer['last_cycle']
+        self.first_cycle = self.__first_cycles[0] if self.__first_cycles else self.last_cycle + 1
+
+    def close(self):
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __load_chunk(self, i):
+        """
+        Reads and decompresses a chunk.
+        :param i: The chunk number.
+        :return: The chunk dictionary.
+        """
+        self.__file.seek(self.__offsets[i])
+        return pickle.loads(zlib.decompress(self.__file.read(self.__ends[i] - self.__offsets[i])))
+
+    def cycles(self, first=None, last=None):
+        """
+        Replays a range of cycles.
+        :param first: The first cycle, the first recorded cycle if None.
+        :param last: The last cycle, the last recorded cycle if None.
+        :return: A generator of (cycle, instruction address, assembly, registers, memory, register written, memory
+        address written) tuples, with None for nothing written. The same registers list and Memory are updated in
+        place for every cycle.
+        """
+        first = self.first_cycle if first is None else max(first, self.first_cycle)
+        last = self.last_cycle if last is None else min(last, self.last_cycle)
+        if first > last:
+            return
+
+        # The chunk holding the first cycle, found by binary search over the index
+        i = bisect.bisect_right(self.__first_cycles, first) - 1
+        registers = None
+        memory = None
+        while i < len(self.__offsets) and self.__first_cycles[i] <= last:
+            chunk = self.__load_chunk(i)
+            if registers is None:
+                registers, memory = self.__restore(chunk['keyframe'])
+            insts = array('I')
+            insts.frombytes(chunk['insts'])
+            writes = array('h')
+            writes.frombytes(chunk['writes'])
+            values = array('q')
+            values.frombytes(chunk['values'])
+            addresses = array('q')
+            addresses.frombytes(chunk['addresses'])
+            exact_values = chunk['exact_values']
+            exact_addresses = chunk['exact_addresses']
+
+            cycle = self.__first_cycles[i]
+            v = 0
+            m = 0
+            for index, write in zip(insts, writes):
+                register = None
+                stored = None
+                if write != no_write:
+                    value = exact_values[v] if v in exact_values else values[v]
+                    v += 1
+                    if write == memory_write:
+                        stored = exact_addresses[m] if m in exact_addresses else addresses[m]
+                        memory.write(stored, value)
+                        m += 1
+                    else:
+                        register = write
+                        registers[write] = value
+                if cycle >= first:
+                    if cycle > last:
+                        return
+                    address, assembly = self.__instructions[index]
+                    yield cycle, address, assembly, registers, memory, register, stored
+                cycle += 1
+            i += 1
+
+    def __restore(self, keyframe):
+        """
+        Builds the state held by a keyframe.
+        :param keyframe: The keyframe dictionary of a chunk.
+        :return: The register list and Memory.
+        """
+        addresses = array('q')
+        addresses.frombytes(keyframe['addresses'])
+        values = array('q')
+        values.frombytes(keyframe['values'])
+        memory = Memory(self.data_begin)
+        for address, value in zip(addresses, values):
+            memory.write(address, value)
+        for address, value in keyframe['exact'].items():
+            memory.write(address, value)
+        memory.max_address = keyframe['max_address']
+        return keyframe['registers'], memory
+
+    def text(self, first=None, last=None):
+        """
+        Regenerates the _sim.txt text of a range of cycles, as written with a trace interval of 1.
+        :param first: The first cycle, the first recorded cycle if None.
+        :param last: The last cycle, the last recorded cycle if None.
+        :return: A generator of the text of each cycle.
+        """
+        renderer = None
+        for cycle, address, assembly, registers, memory, register, stored in self.cycles(first, last):
+            if renderer is None:
+                renderer = StateRenderer(registers, memory, self.data_begin)
+            elif register is not None:
+                renderer.mark_register(register)
+            elif stored is not None:
+                renderer.mark_memory(stored)
+            yield '=' * 21 + '\n' + 'cycle:' + str(cycle) + '\t{}\t{}\n'.format(address, assembly) + '\n' \
+                + renderer.registers_to_string() + '\n' + renderer.memory_to_string()
+
+
+if __name__ == '__main__':
+    infile = ''
+    outfile = ''
+    first = None
+    last = None
+
+    # Get options from command line arguments
+    for i in range(len(sys.argv)):
+        if sys.argv[i] == '-i':
+            infile = sys.argv[i + 1]
+        elif sys.argv[i] == '-o':
+            # Write the text here instead of to standard output
+            outfile = sys.argv[i + 1]
+        elif sys.argv[i] == '-c':
+            # Cycle range FIRST:LAST, either end may be left out
+            start, _, end = sys.argv[i + 1].partition(':')
+            first = int(start) if start else None
+            last = int(end) if end else (first if not _ else None)
+
+    try:
+        reader = DeltaTraceReader(infile)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        quit()
+    with reader:
+        out = open(outfile, 'w') if outfile else sys.stdout
+        try:
+            for s in reader.text(first, last):
+                out.write(s)
+        finally:
+            if outfile:
+                out.close()
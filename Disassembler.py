@@ -1,4 +1,39 @@
+import io
+import mmap
 import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from Instruction import Instruction
+from TraceWriter import TraceWriter
+
+
+def _build_opcode_table(opcode_dict, handlers):
+    """
+    Expands the opcode ranges into a table indexed by every possible 11-bit opcode
+    :param opcode_dict: Maps (low, high) opcode ranges to [format, name]
+    :param handlers: Maps each format to the function that processes it
+    :return: A list of 2048 (handler, name) tuples, None where the opcode is invalid
+    """
+    table = [None] * 2048
+    for (low, high), (inst_format, inst_name) in opcode_dict.items():
+        for opcode in range(low, high + 1):
+            table[opcode] = (handlers[inst_format], inst_name)
+    return table
+
+
+def _build_field_decoders(field_layouts):
+    """
+    Precomputes the shift, mask and sign bit of every field in every instruction format
+    :param field_layouts: Maps each format to its (name, high bit, low bit, signed) fields
+    :return: Maps each format to a tuple of (shift, mask, sign bit) per field, with a sign bit of 0 if unsigned
+    """
+    decoders = {}
+    for inst_format, fields in field_layouts.items():
+        decoders[inst_format] = tuple(
+            (low, (1 << (high - low + 1)) - 1, (1 << (high - low)) if signed else 0)
+            for _, high, low, signed in fields
+        )
+    return decoders
 
 
 class Disassembler:
@@ -6,12 +41,70 @@ class Disassembler:
     inst_spacing = [0, 8, 11, 16, 21, 26, 32]
     break_inst = 0xFEDEFFE7
 
-    def __init__(self, input_file, output_file):
+    # (low opcode, high opcode) : [format, name]
+    opcode_dict = {
+        (0, 0): ['NOP', 'NOP'],
+        (160, 191): ['B', 'B'],
+        (1104, 1104): ['R', 'AND'],
+        (1112, 1112): ['R', 'ADD'],
+        (1160, 1161): ['I', 'ADDI'],
+        (1360, 1360): ['R', 'ORR'],
+        (1440, 1447): ['CB', 'CBZ'],
+        (1448, 1455): ['CB', 'CBNZ'],
+        # (1616, 1616): ['R', 'EOR'], # EOR opcode from book, wrong?
+        (1872, 1872): ['R', 'EOR'],
+        (1624, 1624): ['R', 'SUB'],
+        (1672, 1673): ['I', 'SUBI'],
+        (1684, 1687): ['IM', 'MOVZ'],
+        (1692, 1692): ['R', 'ASR'],
+        (1940, 1943): ['IM', 'MOVK'],
+        (1690, 1690): ['R', 'LSR'],
+        (1691, 1691): ['R', 'LSL'],
+        (1984, 1984): ['D', 'STUR'],
+        (1986, 1986): ['D', 'LDUR'],
+        (2038, 2038): ['BREAK', 'BREAK']
+    }
+
+    # format : (name, high bit, low bit, signed) for each field, in the order decode_fields returns them
+    field_layouts = {
+        'R': (('opcode', 31, 21, False), ('rm', 20, 16, False), ('shamt', 15, 10, False), ('rn', 9, 5, False),
+              ('rd', 4, 0, False)),
+        'D': (('opcode', 31, 21, False), ('offset', 20, 12, False), ('op2', 11, 10, False), ('rn', 9, 5, False),
+              ('rt', 4, 0, False)),
+        'I': (('opcode', 31, 22, False), ('immediate', 21, 10, True), ('rn', 9, 5, False), ('rd', 4, 0, False)),
+        'B': (('opcode', 31, 24, False), ('offset', 23, 0, True)),
+        'CB': (('opcode', 31, 24, False), ('offset', 23, 5, True), ('rt', 4, 0, False)),
+        'IM': (('opcode', 31, 23, False), ('shift', 22, 21, False), ('immediate', 20, 5, False), ('rd', 4, 0, False))
+    }
+
+    # format : ((shift, mask, sign bit), ...), built once from field_layouts
+    field_decoders = _build_field_decoders(field_layouts)
+
+    # input format : byte order of a raw binary image, None for text lines of '0'/'1'
+    input_formats = {
+        'text': None,
+        'le': 'little',
+        'be': 'big'
+    }
+
+    # inputs shorter than this are always processed sequentially
+    parallel_min_words = 1 << 16
+
+    # bump whenever decoding or the _dis.txt output changes, so cached disassemblies are not reused
+    decoder_version = 1
+
+    def __init__(self, input_file, output_file, compression=None, input_format='text', workers=1):
+        if input_format not in Disassembler.input_formats:
+            raise ValueError('ERROR: Unknown input format \'{}\''.format(input_format))
+
         self.__input_file = input_file
         self.__output_file = output_file
+        self.__compression = compression
+        self.__input_format = input_format
+        self.__workers = workers
 
         # Holds information about instructions
-        # mem_address : {dict with name, opcode, fields...}
+        # mem_address : Instruction with name, opcode, fields...
         self.__processed_inst = {}
 
         # Holds information about data
@@ -19,31 +112,9 @@ class Disassembler:
         self.__processed_data = {}
 
         self.__lines_dec = []     # Holds raw lines in decimal
+        self.__image = None       # mmap backing __lines_dec for binary input
         self.__address = 96       # Memory starting address
 
-        self.opcode_dict = {
-            (0, 0): ['NOP', 'NOP'],
-            (160, 191): ['B', 'B'],
-            (1104, 1104): ['R', 'AND'],
-            (1112, 1112): ['R', 'ADD'],
-            (1160, 1161): ['I', 'ADDI'],
-            (1360, 1360): ['R', 'ORR'],
-            (1440, 1447): ['CB', 'CBZ'],
-            (1448, 1455): ['CB', 'CBNZ'],
-            # (1616, 1616): ['R', 'EOR'], # EOR opcode from book, wrong?
-            (1872, 1872): ['R', 'EOR'],
-            (1624, 1624): ['R', 'SUB'],
-            (1672, 1673): ['I', 'SUBI'],
-            (1684, 1687): ['IM', 'MOVZ'],
-            (1692, 1692): ['R', 'ASR'],
-            (1940, 1943): ['IM', 'MOVK'],
-            (1690, 1690): ['R', 'LSR'],
-            (1691, 1691): ['R', 'LSL'],
-            (1984, 1984): ['D', 'STUR'],
-            (1986, 1986): ['D', 'LDUR'],
-            (2038, 2038): ['BREAK', 'BREAK']
-        }
-
     def get_processed_inst(self):
         return self.__processed_inst
 
@@ -58,56 +129,281 @@ class Disassembler:
             self.__read_file()
             self.__process_lines()
         except ValueError as ve:
-            print >> sys.stderr, ve
+            print(ve, file=sys.stderr)
             quit()
+        finally:
+            self.__close_image()
 
     def __read_file(self):
         """
         Reads the designated input file and stores each line as a decimal integer
         """
+        byteorder = Disassembler.input_formats[self.__input_format]
+        if byteorder is None:
+            self.__lines_dec = Disassembler.read_text(self.__input_file)
+        else:
+            self.__lines_dec, self.__image = Disassembler.map_image(self.__input_file, byteorder)
+
+    def __close_image(self):
+        """
+        Releases the memory map of a binary input
+        """
+        if self.__image is not None:
+            self.__lines_dec.release()
+            self.__image.close()
+            self.__image = None
+        self.__lines_dec = []
+
+    @staticmethod
+    def read_text(input_file):
+        """
+        Reads a text input of 32 '0'/'1' characters per line
+        :param input_file: The path of the text input
+        :return: A list with one decimal integer per line
+        """
+        words = []
         line_num = 0
-        with open(self.__input_file, 'r') as f:
+        with open(input_file, 'r') as f:
             for line in f:
                 line = line.rstrip()
                 line_num += 1
                 if len(line) != 32:
                     raise ValueError('ERROR: Invalid instruction on line {}: \'{}\''.format(line_num, line))
-                self.__lines_dec.append(int(line, 2))
+                words.append(int(line, 2))
+        return words
 
-    def __process_lines(self):
+    @staticmethod
+    def map_image(input_file, byteorder):
         """
-        Loops through each decimal line value and calls the function to process it as an instruction or as data
+        Maps a raw binary image of 32-bit words into memory. Images in the machine's byte order are viewed in place
+        without copying; the others are copied once and byte swapped.
+        :param input_file: The path of the binary image
+        :param byteorder: The byte order of the image, 'little' or 'big'
+        :return: A tuple of the sequence of words and the mmap to close once done with it (None if copied)
+        """
+        with open(input_file, 'rb') as f:
+            size = f.seek(0, 2)
+            if size % 4:
+                raise ValueError('ERROR: Binary image size {} is not a multiple of 4 bytes'.format(size))
+            if size == 0:
+                return array('I'), None
+            image = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if byteorder == sys.byteorder:
+            return memoryview(image).cast('I'), image
+
+        words = array('I')
+        words.frombytes(image)
+        image.close()
+        words.byteswap()
+        return words, None
+
+    @staticmethod
+    def iter_words(input_file, input_format='text', chunk_words=1 << 16):
+        """
+        Reads the words of an input lazily, a line or a chunk of a binary image at a time
+        :param input_file: The path of the input
+        :param input_format: The input format ('text', 'le' or 'be')
+        :param chunk_words: The number of words read from a binary image at a time
+        :return: A generator of decimal words
+        """
+        if input_format not in Disassembler.input_formats:
+            raise ValueError('ERROR: Unknown input format \'{}\''.format(input_format))
+        byteorder = Disassembler.input_formats[input_format]
+        if byteorder is None:
+            with open(input_file, 'r') as f:
+                for line_num, line in enumerate(f, 1):
+                    line = line.rstrip()
+                    if len(line) != 32:
+                        raise ValueError('ERROR: Invalid instruction on line {}: \'{}\''.format(line_num, line))
+                    yield int(line, 2)
+        else:
+            with open(input_file, 'rb') as f:
+                while True:
+                    chunk = f.read(4 * chunk_words)
+                    if not chunk:
+                        break
+                    if len(chunk) % 4:
+                        raise ValueError('ERROR: Binary image size {} is not a multiple of 4 bytes'.format(f.tell()))
+                    words = array('I')
+                    words.frombytes(chunk)
+                    if byteorder != sys.byteorder:
+                        words.byteswap()
+                    yield from words
+
+    @staticmethod
+    def text_to_binary(text_file, binary_file, byteorder='little'):
+        """
+        Converts a text input into a raw binary image
+        :param text_file: The path of the text input
+        :param binary_file: The path of the binary image to write
+        :param byteorder: The byte order of the image, 'little' or 'big'
         """
-        out_file = open(self.__output_file + '_dis.txt', 'w')
-        data = False
+        words = array('I', Disassembler.read_text(text_file))
+        if byteorder != sys.byteorder:
+            words.byteswap()
+        with open(binary_file, 'wb') as f:
+            words.tofile(f)
 
-        for line_num, line in enumerate(self.__lines_dec):
-            valid = False
-            if not data:
-                out_file.write(Disassembler.get_bin_spaced(line) + '\t' + str(self.__address) + '\t')
+    @staticmethod
+    def binary_to_text(binary_file, text_file, byteorder='little'):
+        """
+        Converts a raw binary image into a text input
+        :param binary_file: The path of the binary image
+        :param text_file: The path of the text input to write
+        :param byteorder: The byte order of the image, 'little' or 'big'
+        """
+        words, image = Disassembler.map_image(binary_file, byteorder)
+        try:
+            with TraceWriter(text_file) as f:
+                for word in words:
+                    f.write('{0:032b}\n'.format(word))
+        finally:
+            if image is not None:
+                words.release()
+                image.close()
 
-                opcode_dec = self.get_bits_as_decimal(31, 21, line)
+    def __process_lines(self):
+        """
+        Loops through each decimal line value and calls the function to process it as an instruction or as data
+        """
+        with TraceWriter(self.__output_file + '_dis.txt', self.__compression) as out_file:
+            if self.__workers > 1 and len(self.__lines_dec) >= Disassembler.parallel_min_words:
+                self.__process_chunks(out_file)
+            else:
+                self.__process_words(self.__lines_dec, 0, out_file)
 
-                # Loop through all known opcodes
-                for (low, high), inst_info in self.opcode_dict.items():
-                    # Once correct range found, call appropriate function
-                    if low <= opcode_dec <= high:
-                        valid = True
-                        f = getattr(self, '_Disassembler__process_' + inst_info[0].lower())
-                        out_file.write(f(line, inst_info[1]) + '\n')
+    def __process_words(self, words, first_line, out_file, data=False):
+        """
+        Processes a run of consecutive words, the first one at the current address
+        :param words: The decimal values of the words
+        :param first_line: The line number of the first word
+        :param out_file: Where to write the disassembly lines
+        :param data: Whether the words follow the BREAK and are data
+        """
+        processed_inst = self.__processed_inst
+        processed_data = self.__processed_data
+        for address, word, inst in self.__records(words, first_line, data):
+            if inst is None:
+                processed_data[address] = Disassembler.sign_extend(word, 32)
+            else:
+                processed_inst[address] = inst
+            out_file.write(Disassembler.format_record(address, word, inst) + '\n')
 
-                if not valid:
+    def __records(self, words, first_line, data=False):
+        """
+        Decodes consecutive words one at a time, the first one at the current address
+        :param words: An iterable of the decimal values of the words
+        :param first_line: The line number of the first word
+        :param data: Whether the words follow the BREAK and are data
+        :return: A generator of (address, word, Instruction) tuples, with None instead of an Instruction for data
+        """
+        for line_num, line in enumerate(words, first_line):
+            if data:
+                yield self.__address, line, None
+            else:
+                # Look up the format handler by the 11-bit opcode
+                entry = Disassembler.opcode_table[line >> 21]
+                if entry is None:
                     raise ValueError('ERROR: Invalid instruction on line {}: \'{}\''.format(line_num, line))
+                f, inst_name = entry
+                yield self.__address, line, f(self, line, inst_name)
 
                 # Set data flag to True when BREAK is reached
                 if line == self.break_inst:
                     data = True
 
-            else:
-                out_file.write(self.__process_data(line) + '\n')
-
             self.__address += 4
 
+    def stream(self):
+        """
+        Reads and decodes the input one word at a time, without keeping the words, the processed instructions or the
+        processed data, so memory use does not grow with the input. Nothing is written; format_record gives the
+        _dis.txt line of a record.
+        :return: A generator of (address, word, Instruction) tuples in address order, with None instead of an
+        Instruction for the data words after the BREAK
+        """
+        self.__address = 96
+        return self.__records(Disassembler.iter_words(self.__input_file, self.__input_format), 0)
+
+    def decode_word(self, word, address):
+        """
+        Decodes a single instruction word, e.g. when a simulator first reaches it
+        :param word: The decimal value of the 32-bit instruction
+        :param address: The memory address of the instruction
+        :return: The decoded Instruction
+        """
+        entry = Disassembler.opcode_table[word >> 21]
+        if entry is None:
+            raise ValueError('ERROR: Invalid instruction at address {}: \'{:032b}\''.format(address, word))
+        f, inst_name = entry
+        self.__address = address
+        return f(self, word, inst_name)
+
+    def __process_chunks(self, out_file):
+        """
+        Splits the instruction and data regions into chunks, processes them on a pool of worker processes and merges
+        the results in address order
+        :param out_file: Where to write the disassembly lines
+        """
+        words = self.__lines_dec
+        brk = Disassembler.find_break(words)
+        num_inst = brk + 1 if brk >= 0 else len(words)
+        chunk_size = max(Disassembler.parallel_min_words // 4, -(-len(words) // (4 * self.__workers)))
+
+        chunks = []
+        for first, stop, data in ((0, num_inst, False), (num_inst, len(words), True)):
+            for start in range(first, stop, chunk_size):
+                chunks.append((start, min(stop, start + chunk_size), data))
+
+        pool = ProcessPoolExecutor(max_workers=self.__workers)
+        try:
+            futures = [pool.submit(Disassembler.process_chunk, list(words[start:stop]), start, data)
+                       for start, stop, data in chunks]
+            for future in futures:
+                text, processed_inst, processed_data = future.result()
+                out_file.write(text)
+                self.__processed_inst.update(processed_inst)
+                self.__processed_data.update(processed_data)
+        finally:
+            pool.shutdown(cancel_futures=True)
+        self.__address = 96 + 4 * len(words)
+
+    @staticmethod
+    def process_chunk(words, first_line, data):
+        """
+        Processes a chunk of the input on its own, e.g. in a worker process
+        :param words: The decimal values of the words in the chunk
+        :param first_line: The line number of the first word, giving its address
+        :param data: Whether the words follow the BREAK and are data
+        :return: A tuple of the disassembly text, the processed instructions and the processed data of the chunk
+        """
+        d = Disassembler(None, None)
+        d.__address = 96 + 4 * first_line
+        out = io.StringIO()
+        d.__process_words(words, first_line, out, data)
+        return out.getvalue(), d.__processed_inst, d.__processed_data
+
+    @staticmethod
+    def find_break(words):
+        """
+        Finds the first BREAK word without decoding the words before it
+        :param words: A list, array or memory-mapped memoryview of decimal words
+        :return: The index of the first BREAK, -1 if there is none
+        """
+        if isinstance(words, memoryview):
+            # Search the mapped bytes directly, keeping only word-aligned matches
+            pattern = array('I', [Disassembler.break_inst]).tobytes()
+            image = words.obj
+            pos = image.find(pattern)
+            while pos != -1 and pos % 4:
+                pos = image.find(pattern, pos + 1)
+            return pos // 4 if pos != -1 else -1
+        try:
+            return words.index(Disassembler.break_inst)
+        except ValueError:
+            return -1
+
     @staticmethod
     def tc_to_dec(bin_str):
         """
@@ -115,14 +411,19 @@ class Disassembler:
         :param bin_str: A two's complement binary string
         :return: The corresponding decimal integer
         """
-        dec = int(bin_str, 2)
-        # If positive, just convert to decimal
-        if bin_str[0] == '0':
-            return dec
-        # If negative, flip bits and add 1, then multiply decimal by -1
-        else:
-            mask_str = '1' * len(bin_str)
-            return -1 * ((dec ^ int(mask_str, 2)) + 1)
+        return Disassembler.sign_extend(int(bin_str, 2), len(bin_str))
+
+    @staticmethod
+    def sign_extend(value, bits):
+        """
+        Interprets the low bits of an unsigned integer as a two's complement number
+        :param value: The unsigned integer, less than 2 ** bits
+        :param bits: The width of the two's complement number
+        :return: The corresponding signed decimal integer
+        """
+        if value >> (bits - 1):
+            return value - (1 << bits)
+        return value
 
     @staticmethod
     def get_bits_as_decimal(high, low, b, signed=False):
@@ -131,18 +432,29 @@ class Disassembler:
         :param high: The leftmost desired bit
         :param low: The rightmost desired bit
         :param b: The binary string
-        :return: The decimal value corresponding to the bots extracted from the binary string
-        """
-        mask_str = '0' * (31 - high) + '1' * (high - low + 1) + '0' * low
-        mask_int = int(mask_str, 2)
-        t1 = b & mask_int
-        out = t1 >> low
-        out_str = bin(out)[2:].zfill(high - low + 1)
-        # if negative number and signed
-        if out_str[0] == '1' and signed:
-            return Disassembler.tc_to_dec(out_str)
-        else:
-            return out
+        :param signed: Whether the bits are a two's complement number
+        :return: The decimal value corresponding to the bits extracted from the binary string
+        """
+        out = (b >> low) & ((1 << (high - low + 1)) - 1)
+        if signed:
+            return Disassembler.sign_extend(out, high - low + 1)
+        return out
+
+    @staticmethod
+    def decode_fields(inst_format, inst_dec):
+        """
+        Extracts every field of an instruction format at once, using the precomputed masks in field_decoders
+        :param inst_format: The instruction format ('R', 'D', 'I', 'B', 'CB' or 'IM')
+        :param inst_dec: The decimal value of the 32-bit instruction
+        :return: A tuple of the field values, in the order given by field_layouts
+        """
+        fields = []
+        for shift, mask, sign in Disassembler.field_decoders[inst_format]:
+            value = (inst_dec >> shift) & mask
+            if value & sign:
+                value -= mask + 1
+            fields.append(value)
+        return tuple(fields)
 
     @staticmethod
     def get_bin_spaced(inst_dec):
@@ -164,35 +476,12 @@ class Disassembler:
             11        5   6       5   5
         :param inst_dec: The decimal value of the 32-bit instruction
         :param inst_name: The assembly name of the instruction
-        :return: A string containing the ARM assembly instruction
+        :return: The decoded Instruction
         """
         # Extract fields from machine instruction
-        opcode = Disassembler.get_bits_as_decimal(31, 21, inst_dec)
-        rm = Disassembler.get_bits_as_decimal(20, 16, inst_dec)
-        shamt = Disassembler.get_bits_as_decimal(15, 10, inst_dec)
-        rn = Disassembler.get_bits_as_decimal(9, 5, inst_dec)
-        rd = Disassembler.get_bits_as_decimal(4, 0, inst_dec)
-
-        # Return proper assembly instruction
-        if inst_name == 'LSL' or inst_name == 'LSR' or inst_name == 'ASR':
-            assembly = '{}\tR{}, R{}, #{}'.format(inst_name, rd, rn, shamt)
-        else:
-            assembly = '{}\tR{}, R{}, R{}'.format(inst_name, rd, rn, rm)
-
-        # Add instruction fields to data structure
-        self.__processed_inst[self.__address] = {
-            'address': self.__address,
-            'name': inst_name,
-            'type': 'R',
-            'opcode': opcode,
-            'rm': rm,
-            'shamt': shamt,
-            'rn': rn,
-            'rd': rd,
-            'assembly': assembly
-        }
-
-        return assembly
+        opcode, rm, shamt, rn, rd = Disassembler.decode_fields('R', inst_dec)
+
+        return Instruction(self.__address, inst_name, 'R', opcode=opcode, rm=rm, shamt=shamt, rn=rn, rd=rd)
 
     def __process_d(self, inst_dec, inst_name):
         """
@@ -201,32 +490,12 @@ class Disassembler:
             11        9       2   5   5
         :param inst_dec: The decimal value of the 32-bit instruction
         :param inst_name: The assembly name of the instruction
-        :return: A string containing the ARM assembly instruction
+        :return: The decoded Instruction
         """
         # Extract fields from machine instruction
-        opcode = Disassembler.get_bits_as_decimal(31, 21, inst_dec)
-        offset = Disassembler.get_bits_as_decimal(20, 12, inst_dec)
-        op2 = Disassembler.get_bits_as_decimal(11, 10, inst_dec)
-        rn = Disassembler.get_bits_as_decimal(9, 5, inst_dec)
-        rt = Disassembler.get_bits_as_decimal(4, 0, inst_dec)
-
-        assembly = '{}\tR{}, [R{}, #{}]'.format(inst_name, rt, rn, offset)
-
-        # Add instruction fields to data structure
-        self.__processed_inst[self.__address] = {
-            'address': self.__address,
-            'name': inst_name,
-            'type': 'D',
-            'opcode': opcode,
-            'offset': offset,
-            'op2': op2,
-            'rn': rn,
-            'rt': rt,
-            'assembly': assembly
-        }
-
-        # Return proper assembly instruction
-        return assembly
+        opcode, offset, op2, rn, rt = Disassembler.decode_fields('D', inst_dec)
+
+        return Instruction(self.__address, inst_name, 'D', opcode=opcode, offset=offset, op2=op2, rn=rn, rt=rt)
 
     def __process_i(self, inst_dec, inst_name):
         """
@@ -235,30 +504,12 @@ class Disassembler:
             10        12          5   5
         :param inst_dec: The decimal value of the 32-bit instruction
         :param inst_name: The assembly name of the instruction
-        :return: A string containing the ARM assembly instruction
+        :return: The decoded Instruction
         """
         # Extract fields from machine instruction
-        opcode = Disassembler.get_bits_as_decimal(31, 22, inst_dec)
-        immediate = Disassembler.tc_to_dec('{0:012b}'.format(Disassembler.get_bits_as_decimal(21, 10, inst_dec)))
-        rn = Disassembler.get_bits_as_decimal(9, 5, inst_dec)
-        rd = Disassembler.get_bits_as_decimal(4, 0, inst_dec)
-
-        assembly = '{}\tR{}, R{}, #{}'.format(inst_name, rd, rn, immediate)
-
-        # Add instruction fields to data structure
-        self.__processed_inst[self.__address] = {
-            'address': self.__address,
-            'name': inst_name,
-            'type': 'I',
-            'opcode': opcode,
-            'immediate': immediate,
-            'rn': rn,
-            'rd': rd,
-            'assembly': assembly
-        }
-
-        # Return proper assembly instruction
-        return assembly
+        opcode, immediate, rn, rd = Disassembler.decode_fields('I', inst_dec)
+
+        return Instruction(self.__address, inst_name, 'I', opcode=opcode, immediate=immediate, rn=rn, rd=rd)
 
     def __process_b(self, inst_dec, inst_name):
         """
@@ -267,26 +518,12 @@ class Disassembler:
             6         26
         :param inst_dec: The decimal value of the 32-bit instruction
         :param inst_name: The assembly name of the instruction
-        :return: A string containing the ARM assembly instruction
+        :return: The decoded Instruction
         """
         # Extract fields from machine instruction
-        opcode = Disassembler.get_bits_as_decimal(31, 24, inst_dec)
-        address = Disassembler.get_bits_as_decimal(23, 0, inst_dec, signed=True)
-
-        assembly = '{}\t#{}'.format(inst_name, address)
-
-        # Add instruction fields to data structure
-        self.__processed_inst[self.__address] = {
-            'address': self.__address,
-            'name': inst_name,
-            'type': 'B',
-            'opcode': opcode,
-            'offset': address,
-            'assembly': assembly
-        }
+        opcode, address = Disassembler.decode_fields('B', inst_dec)
 
-        # Return proper assembly instruction
-        return assembly
+        return Instruction(self.__address, inst_name, 'B', opcode=opcode, offset=address)
 
     def __process_cb(self, inst_dec, inst_name):
         """
@@ -295,28 +532,12 @@ class Disassembler:
             8         19          5
         :param inst_dec: The decimal value of the 32-bit instruction
         :param inst_name: The assembly name of the instruction
-        :return: A string containing the ARM assembly instruction
+        :return: The decoded Instruction
         """
         # Extract fields from machine instruction
-        opcode = Disassembler.get_bits_as_decimal(31, 24, inst_dec)
-        offset = Disassembler.get_bits_as_decimal(23, 5, inst_dec, signed=True)
-        rt = Disassembler.get_bits_as_decimal(4, 0, inst_dec)
-
-        assembly = '{}\tR{}, #{}'.format(inst_name, rt, offset)
-
-        # Add instruction fields to data structure
-        self.__processed_inst[self.__address] = {
-            'address': self.__address,
-            'name': inst_name,
-            'type': 'CB',
-            'opcode': opcode,
-            'offset': offset,
-            'rt': rt,
-            'assembly': assembly
-        }
-
-        # Return proper assembly instruction
-        return assembly
+        opcode, offset, rt = Disassembler.decode_fields('CB', inst_dec)
+
+        return Instruction(self.__address, inst_name, 'CB', opcode=opcode, offset=offset, rt=rt)
 
     def __process_im(self, inst_dec, inst_name):
         """
@@ -325,30 +546,12 @@ class Disassembler:
             9       2      16          5
         :param inst_dec: The decimal value of the 32-bit instruction
         :param inst_name: The assembly name of the instruction
-        :return: A string containing the ARM assembly instruction
+        :return: The decoded Instruction
         """
         # Extract fields from machine instruction
-        opcode = Disassembler.get_bits_as_decimal(31, 23, inst_dec)
-        shift = Disassembler.get_bits_as_decimal(22, 21, inst_dec)
-        immediate = Disassembler.get_bits_as_decimal(20, 5, inst_dec)
-        rd = Disassembler.get_bits_as_decimal(4, 0, inst_dec)
-
-        assembly = '{}\tR{}, {}, LSL {}'.format(inst_name, rd, immediate, shift * 16)
-
-        # Add instruction fields to data structure
-        self.__processed_inst[self.__address] = {
-            'address': self.__address,
-            'name': inst_name,
-            'type': 'IM',
-            'opcode': opcode,
-            'shift': shift,
-            'immediate': immediate,
-            'rd': rd,
-            'assembly': assembly
-        }
-
-        # Return proper assembly instruction
-        return assembly
+        opcode, shift, immediate, rd = Disassembler.decode_fields('IM', inst_dec)
+
+        return Instruction(self.__address, inst_name, 'IM', opcode=opcode, shift=shift, immediate=immediate, rd=rd)
 
     def __process_nop(self, inst_dec, inst_name):
         """
@@ -358,23 +561,14 @@ class Disassembler:
             0x00000000
         :param inst_dec: The decimal value of the 32-bit instruction
         :param inst_name: The assembly name of the instruction
-        :return: A string containing the ARM assembly instruction
+        :return: The decoded Instruction
         """
         # If the instruction isn't all 0s, raise error because opcode is zero -> invalid instruction
         if inst_dec != 0:
             bin_str = '{0:032b}'.format(inst_dec)
             raise ValueError('ERROR: Invalid instruction on line {}: \'{}\''.format((self.__address - 96) / 4, bin_str))
 
-        # Add instruction fields to data structure
-        self.__processed_inst[self.__address] = {
-            'address': self.__address,
-            'name': inst_name,
-            'type': 'NOP',
-            'assembly': 'NOP'
-        }
-
-        # Return proper assembly instruction
-        return inst_name
+        return Instruction(self.__address, inst_name, 'NOP')
 
     def __process_break(self, inst_dec, inst_name):
         """
@@ -384,39 +578,45 @@ class Disassembler:
             0xFEDEFFE7
         :param inst_dec: The decimal value of the 32-bit instruction
         :param inst_name: The assembly name of the instruction
-        :return: A string containing the ARM assembly instruction
+        :return: The decoded Instruction
         """
-        # Add instruction fields to data structure
-        self.__processed_inst[self.__address] = {
-            'address': self.__address,
-            'name': inst_name,
-            'type': 'BREAK',
-            'assembly': 'BREAK'
-        }
+        return Instruction(self.__address, inst_name, 'BREAK')
 
-        # Return proper assembly instruction
-        return inst_name
-
-    def __process_data(self, dec):
+    @staticmethod
+    def format_record(address, word, inst):
         """
-        Process a 32-bit two's complement data value
-        :param dec: The unsigned decimal of the 32-bit data
-        :return: A string containing the 32-bit two's complement binary string, the address, and the signed decimal
-        value
+        Formats one line of the _dis.txt output
+        :param address: The memory address of the word
+        :param word: The decimal value of the 32-bit word
+        :param inst: The decoded Instruction, None for a data word
+        :return: The spaced binary string, the address and the assembly instruction, or for data the binary string,
+        the address and the signed decimal value
         """
-        bin_str = '{0:032b}'.format(dec)
-        tc_dec = Disassembler.tc_to_dec(bin_str)
-
-        # Add data to data structure
-        self.__processed_data[self.__address] = tc_dec
-
-        # Return string for output
-        return '{}\t{}\t{}'.format(bin_str, self.__address, tc_dec)
+        if inst is None:
+            return '{0:032b}\t{1}\t{2}'.format(word, address, Disassembler.sign_extend(word, 32))
+        return Disassembler.get_bin_spaced(word) + '\t' + str(address) + '\t' + inst.assembly
+
+    # 11-bit opcode : (format handler, name), built once from opcode_dict
+    opcode_table = _build_opcode_table(opcode_dict, {
+        'R': __process_r,
+        'D': __process_d,
+        'I': __process_i,
+        'B': __process_b,
+        'CB': __process_cb,
+        'IM': __process_im,
+        'NOP': __process_nop,
+        'BREAK': __process_break
+    })
 
 
 if __name__ == "__main__":
     infile = ''
     outfile = ''
+    compression = None
+    input_format = 'text'
+    convert = None
+    workers = 1
+    stream = False
 
     # Get in/out file from command line arguments
     for i in range(len(sys.argv)):
@@ -424,7 +624,35 @@ if __name__ == "__main__":
             infile = sys.argv[i + 1]
         elif sys.argv[i] == '-o':
             outfile = sys.argv[i + 1]
-
-    # Create disassembler and run
-    d = Disassembler(infile, outfile)
-    d.run()
+        elif sys.argv[i] == '-z':
+            # Compress the output (gz or zst)
+            compression = sys.argv[i + 1]
+        elif sys.argv[i] == '-b':
+            # Input is a raw binary image (le or be)
+            input_format = sys.argv[i + 1]
+        elif sys.argv[i] == '-j':
+            # Disassemble large inputs on N worker processes
+            workers = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-c':
+            # Convert the input to a binary image (le or be) or to text instead of disassembling
+            convert = sys.argv[i + 1]
+        elif sys.argv[i] == '-s':
+            # Write the disassembly to stdout as it is decoded instead of to a file
+            stream = True
+
+    if convert == 'text':
+        Disassembler.binary_to_text(infile, outfile, Disassembler.input_formats[input_format] or sys.byteorder)
+    elif convert is not None:
+        Disassembler.text_to_binary(infile, outfile, Disassembler.input_formats[convert])
+    elif stream:
+        d = Disassembler(infile, outfile, input_format=input_format)
+        try:
+            for record in d.stream():
+                sys.stdout.write(Disassembler.format_record(*record) + '\n')
+        except ValueError as ve:
+            print(ve, file=sys.stderr)
+            quit()
+    else:
+        # Create disassembler and run
+        d = Disassembler(infile, outfile, compression, input_format, workers)
+        d.run()
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import pickle
+import zlib
+from Disassembler import Disassembler
+from Instruction import Instruction
+from TraceWriter import TraceWriter
+
+
+class DisassemblyCache:
+    """
+    On-disk cache of disassembly results. Entries are keyed by a hash of the input file, its format, the output
+    compression and the decoder version, and hold the processed instructions, the processed data and the bytes of
+    the _dis.txt output. A hit writes the stored output and returns the tables without decoding anything. Entries
+    are evicted least recently used first once the cache grows past max_bytes.
+    """
+    magic = b'T13DIS01'
+    suffix = '.dis'
+
+    def __init__(self, directory, max_bytes=256 << 20):
+        self.__directory = directory
+        self.__max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(input_file, input_format='text', compression=None):
+        """
+        Hashes an input file together with everything else that changes its disassembly
+        :param input_file: The input file
+        :param input_format: The input format ('text', 'le' or 'be')
+        :param compression: The compression of the _dis.txt output
+        :return: The hex digest naming the cache entry
+        """
+        h = hashlib.sha256()
+        h.update('{}\0{}\0{}\0'.format(Disassembler.decoder_version, input_format, compression).encode())
+        with open(input_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def disassemble(create, input_file, output_file, compression=None, input_format='text', cache_dir=None):
+        """
+        Disassembles an input, reusing the results stored in a cache directory for an unchanged input
+        :param create: Called without arguments on a miss to create the disassembler, e.g. a Disassembler class
+        :param input_file: The input file
+        :param output_file: The output prefix
+        :param compression: The compression of the _dis.txt output
+        :param input_format: The input format ('text', 'le' or 'be')
+        :param cache_dir: The cache directory, None to always disassemble
+        :return: A tuple of the processed instructions and the processed data
+        """
+        cache = DisassemblyCache(cache_dir) if cache_dir else None
+        if cache is not None:
+            key = DisassemblyCache.key(input_file, input_format, compression)
+            cached = cache.get(key, output_file, compression)
+            if cached is not None:
+                return cached
+
+        d = create()
+        d.run()
+        processed_inst = d.get_processed_inst()
+        processed_data = d.get_processed_data()
+        if cache is not None:
+            cache.put(key, output_file, processed_inst, processed_data, compression)
+        return processed_inst, processed_data
+
+    def get(self, key, output_file, compression=None):
+        """
+        Looks up an entry and, on a hit, writes its _dis.txt output
+        :param key: The entry key from key()
+        :param output_file: The output prefix
+        :param compression: The compression of the _dis.txt output
+        :return: A tuple of the processed instructions and the processed data, None on a miss
+        """
+        path = self.__path(key)
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            return None
+        if not raw.startswith(DisassemblyCache.magic):
+            return None
+        try:
+            inst_rows, processed_data, dis = pickle.loads(zlib.decompress(raw[len(DisassemblyCache.magic):]))
+        except (zlib.error, pickle.UnpicklingError, EOFError, ValueError):
+            # A corrupt entry is a miss and gets replaced by the next put
+            return None
+
+        with open(output_file + '_dis.txt' + TraceWriter.compressions[compression], 'wb') as f:
+            f.write(dis)
+
+        # Mark the entry as recently used
+        os.utime(path)
+        processed_inst = dict((row[0], Instruction(*row)) for row in inst_rows)
+        return processed_inst, processed_data
+
+    def put(self, key, output_file, processed_inst, processed_data, compression=None):
+        """
+        Stores the results of a disassembly, reading its _dis.txt output back, then evicts old entries
+        :param key: The entry key from key()
+        :param output_file: The output prefix the disassembler wrote to
+        :param processed_inst: The processed instructions
+        :param processed_data: The processed data
+        :param compression: The compression of the _dis.txt output
+        """
+        with open(output_file + '_dis.txt' + TraceWriter.compressions[compression], 'rb') as f:
+            dis = f.read()
+
+        # Instructions are stored as plain tuples, which pickle and load much faster than objects
+        inst_rows = [tuple(getattr(inst, field) for field in Instruction.__slots__)
+                     for inst in processed_inst.values()]
+        payload = zlib.compress(pickle.dumps((inst_rows, processed_data, dis), pickle.HIGHEST_PROTOCOL), 1)
+
+        path = self.__path(key)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(DisassemblyCache.magic)
+            f.write(payload)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.__directory):
+            if not name.endswith(DisassemblyCache.suffix):
+                continue
+            try:
+                st = os.stat(os.path.join(self.__directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.__max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.__directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def __path(self, key):
+        return os.path.join(self.__directory, key + DisassemblyCache.suffix)
@@ -0,0 +1,115 @@
+class Instruction:
+    """
+    A decoded instruction. Fields a format does not use are None, and the assembly text is only built when it is
+    read. Indexing with a field name (inst['rd']) works like the dictionaries used before, raising KeyError for
+    fields the format does not have.
+    """
+    __slots__ = ('address', 'name', 'type', 'opcode', 'rm', 'shamt', 'rn', 'rd', 'rt', 'offset', 'op2', 'immediate',
+                 'shift')
+
+    # type : fields held by that type, besides address, name and type
+    type_fields = {
+        'R': ('opcode', 'rm', 'shamt', 'rn', 'rd'),
+        'D': ('opcode', 'offset', 'op2', 'rn', 'rt'),
+        'I': ('opcode', 'immediate', 'rn', 'rd'),
+        'B': ('opcode', 'offset'),
+        'CB': ('opcode', 'offset', 'rt'),
+        'IM': ('opcode', 'shift', 'immediate', 'rd'),
+        'NOP': (),
+        'BREAK': ()
+    }
+
+    def __init__(self, address, name, inst_type, opcode=None, rm=None, shamt=None, rn=None, rd=None, rt=None,
+                 offset=None, op2=None, immediate=None, shift=None):
+        self.address = address
+        self.name = name
+        self.type = inst_type
+        self.opcode = opcode
+        self.rm = rm
+        self.shamt = shamt
+        self.rn = rn
+        self.rd = rd
+        self.rt = rt
+        self.offset = offset
+        self.op2 = op2
+        self.immediate = immediate
+        self.shift = shift
+
+    @property
+    def assembly(self):
+        """
+        Builds the ARM assembly text of the instruction
+        :return: A string containing the ARM assembly instruction
+        """
+        name = self.name
+        inst_type = self.type
+        if inst_type == 'R':
+            if name == 'LSL' or name == 'LSR' or name == 'ASR':
+                return '{}\tR{}, R{}, #{}'.format(name, self.rd, self.rn, self.shamt)
+            return '{}\tR{}, R{}, R{}'.format(name, self.rd, self.rn, self.rm)
+        elif inst_type == 'D':
+            return '{}\tR{}, [R{}, #{}]'.format(name, self.rt, self.rn, self.offset)
+        elif inst_type == 'I':
+            return '{}\tR{}, R{}, #{}'.format(name, self.rd, self.rn, self.immediate)
+        elif inst_type == 'B':
+            return '{}\t#{}'.format(name, self.offset)
+        elif inst_type == 'CB':
+            return '{}\tR{}, #{}'.format(name, self.rt, self.offset)
+        elif inst_type == 'IM':
+            return '{}\tR{}, {}, LSL {}'.format(name, self.rd, self.immediate, self.shift * 16)
+        return name
+
+    def operands(self):
+        """
+        Finds the registers the instruction reads and writes.
+        :return: A tuple of the registers read and the register written, None if it writes none.
+        """
+        inst_type = self.type
+        if inst_type == 'R':
+            if self.name == 'LSL' or self.name == 'LSR' or self.name == 'ASR':
+                return (self.rn,), self.rd
+            return (self.rn, self.rm), self.rd
+        elif inst_type == 'I':
+            return (self.rn,), self.rd
+        elif inst_type == 'D':
+            if self.name == 'STUR':
+                return (self.rn, self.rt), None
+            if self.name == 'LDUR':
+                return (self.rn,), self.rt
+        elif inst_type == 'CB':
+            return (self.rt,), None
+        elif inst_type == 'IM':
+            return ((self.rd,) if self.name == 'MOVK' else ()), self.rd
+        return (), None
+
+    def is_taken(self, registers):
+        """
+        Decides whether a conditional branch is taken. The condition decides it, not the next PC, since a branch to
+        pc + 4 is taken either way.
+        :param registers: The register values before the branch runs.
+        :return: True if the branch is taken.
+        """
+        return (registers[self.rt] == 0) == (self.name == 'CBZ')
+
+    def keys(self):
+        """
+        Returns the field names held by this instruction, in the order of the old dictionaries.
+        :return: A tuple of field names.
+        """
+        return ('address', 'name', 'type') + Instruction.type_fields[self.type] + ('assembly',)
+
+    def __getitem__(self, key):
+        if key not in self.keys():
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __eq__(self, other):
+        if not isinstance(other, Instruction):
+            return NotImplemented
+        return all(getattr(self, s) == getattr(other, s) for s in Instruction.__slots__)
+
+    def __repr__(self):
+        return 'Instruction({})'.format(', '.join('{}={!r}'.format(k, self[k]) for k in self.keys()))
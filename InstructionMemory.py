@@ -0,0 +1,98 @@
+from array import array
+from Disassembler import Disassembler
+
+
+class InstructionMemory:
+    """
+    Instruction memory holding raw 32-bit words, used by a Simulator in place of the dictionary of processed
+    instructions. A word is decoded the first time its address is read and the Instruction is kept, so the cost of
+    decoding is proportional to the code that actually runs instead of the size of the program.
+    """
+
+    def __init__(self, base, words):
+        self.__base = base
+        self.__words = array('I', words)
+        self.__end = base + 4 * len(self.__words)
+        self.__decoder = Disassembler(None, None)
+
+        # address : Instruction, for the words decoded so far
+        self.__decoded = {}
+
+        # address : Instruction, for the instructions replaced with __setitem__
+        self.__replaced = {}
+
+    def __getitem__(self, address):
+        inst = self.__decoded.get(address)
+        if inst is None:
+            if address not in self:
+                raise KeyError(address)
+            inst = self.__decoded[address] = self.__decoder.decode_word(self.__words[(address - self.__base) >> 2],
+                                                                        address)
+        return inst
+
+    def __setitem__(self, address, inst):
+        if address not in self:
+            raise KeyError(address)
+        self.__decoded[address] = inst
+        self.__replaced[address] = inst
+
+    def __contains__(self, address):
+        return self.__base <= address < self.__end and not (address - self.__base) & 3
+
+    def __len__(self):
+        return len(self.__words)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, address, default=None):
+        return self[address] if address in self else default
+
+    def keys(self):
+        """
+        Returns every instruction address without decoding anything.
+        :return: A range of addresses.
+        """
+        return range(self.__base, self.__end, 4)
+
+    def values(self):
+        """
+        Decodes every remaining word and returns the instructions in address order.
+        :return: A list of Instructions.
+        """
+        return [self[address] for address in self.keys()]
+
+    def items(self):
+        """
+        Decodes every remaining word and returns the instructions in address order.
+        :return: A list of (address, Instruction) tuples.
+        """
+        return [(address, self[address]) for address in self.keys()]
+
+    def to_image(self):
+        """
+        Returns what is needed to rebuild this instruction memory without decoding anything, e.g. for a checkpoint.
+        :return: A dictionary with the base address, the raw words as bytes and the list of replaced Instructions.
+        """
+        return {'base': self.__base, 'words': self.__words.tobytes(), 'replaced': list(self.__replaced.values())}
+
+    @classmethod
+    def from_image(cls, image):
+        """
+        Rebuilds an instruction memory returned by to_image.
+        :param image: The dictionary from to_image.
+        :return: The InstructionMemory.
+        """
+        words = array('I')
+        words.frombytes(image['words'])
+        memory = cls(image['base'], words)
+        for inst in image['replaced']:
+            memory[inst.address] = inst
+        return memory
+
+    def decoded(self):
+        """
+        Returns the number of words decoded so far.
+        :return: The count.
+        """
+        return len(self.__decoded)
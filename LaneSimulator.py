@@ -0,0 +1,363 @@
+import sys
+from Disassembler import Disassembler
+from Memory import Memory
+from StateRenderer import StateRenderer
+from TraceWriter import TraceWriter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _to_int64(val):
+    """
+    Wraps an integer to a signed 64-bit value
+    :param val: The integer
+    :return: The value as a signed 64-bit integer
+    """
+    val &= 0xFFFFFFFFFFFFFFFF
+    return val - (1 << 64) if val >> 63 else val
+
+
+class LaneSimulator:
+    """
+    Runs one program over K independent machine states (lanes) in lockstep. Registers and data memory are NumPy
+    arrays of shape (K, n), and each instruction is performed for every lane at its PC with one vector operation.
+    Lanes that diverge at a CBZ/CBNZ are kept apart by a mask: each step runs the instruction at the lowest PC of
+    any running lane, for the lanes at that PC only, so lanes rejoin as soon as their PCs meet again.
+
+    Unlike Simulator, values are signed 64-bit integers that wrap on overflow, and memory addresses must be
+    word-aligned.
+    """
+    # pc of lanes that reached the BREAK
+    done_pc = np.iinfo(np.int64).max if np is not None else None
+
+    def __init__(self, inst, data_sets, num_registers=32, registers=None):
+        if np is None:
+            raise ValueError('ERROR: Lane simulation requires the numpy package')
+        if not data_sets:
+            raise ValueError('ERROR: Lane simulation needs at least one lane')
+
+        self.__instructions = inst
+        self.__data_begin = max(inst.keys()) + 4
+        self.__program_base = min(inst.keys())
+        self.__lanes = len(data_sets)
+        self.__all = np.arange(self.__lanes)
+
+        self.__registers = np.zeros((self.__lanes, num_registers), dtype=np.int64)
+        if registers is not None:
+            self.__registers[:] = registers
+
+        # Memory holds the words from memory_base up to the highest initial address, and grows either way on stores
+        addresses = [a for data in data_sets for a in data.keys()] + [self.__data_begin]
+        for a in addresses:
+            self.__check_address(a)
+        self.__memory_base = min(addresses)
+        self.__memory = np.zeros((self.__lanes, (max(addresses) - self.__memory_base) // 4 + 1), dtype=np.int64)
+        # Highest address written per lane, like Memory.max_address, -1 while memory is empty
+        self.__max_address = np.full(self.__lanes, -1, dtype=np.int64)
+        for lane, data in enumerate(data_sets):
+            for a, val in data.items():
+                self.__memory[lane, (a - self.__memory_base) >> 2] = _to_int64(val)
+            if data:
+                self.__max_address[lane] = max(data.keys())
+
+        self.__pcs = np.full(self.__lanes, self.__program_base, dtype=np.int64)
+        self.__cycles = np.zeros(self.__lanes, dtype=np.int64)
+        self.__last = [None] * self.__lanes
+
+        self.__program = [None] * ((self.__data_begin - self.__program_base) // 4)
+        for address, i in inst.items():
+            self.__program[(address - self.__program_base) // 4] = (self.__decode(i), i)
+
+    def run(self):
+        """
+        Runs every lane until it reaches the BREAK.
+        :return: The number of cycles each lane ran, as an array of shape (K,).
+        """
+        pcs = self.__pcs
+        cycles = self.__cycles
+        program = self.__program
+        base = self.__program_base
+        done_pc = LaneSimulator.done_pc
+
+        while True:
+            pc = int(pcs.min())
+            if pc == done_pc:
+                break
+            index = (pc - base) >> 2
+            if not 0 <= index < len(program) or program[index] is None:
+                raise ValueError('ERROR: Can\'t access instruction outside instruction memory ({}) in lanes {}'.format(
+                    pc, np.flatnonzero(pcs == pc).tolist()))
+            mask = pcs == pc
+            lanes = slice(None) if mask.all() else np.flatnonzero(mask)
+            step, inst = program[index]
+            cycles[lanes] += 1
+            if inst.type == 'BREAK':
+                pcs[lanes] = done_pc
+                for lane in self.__all[lanes].tolist():
+                    self.__last[lane] = inst
+            else:
+                pcs[lanes] = step(lanes)
+        return cycles
+
+    def __decode(self, inst):
+        """
+        Builds the vector step function of an instruction.
+        :param inst: The Instruction to translate.
+        :return: A function performing the instruction for the given lanes (a slice or an index array) and returning
+        their next PCs.
+        """
+        name = inst.name
+        next_pc = inst.address + 4
+        regs = self.__registers
+
+        if inst.type == 'R':
+            rm, shamt, rn, rd = inst.rm, inst.shamt, inst.rn, inst.rd
+            ops = {
+                'AND': lambda lanes: regs[lanes, rn] & regs[lanes, rm],
+                'ADD': lambda lanes: regs[lanes, rn] + regs[lanes, rm],
+                'ORR': lambda lanes: regs[lanes, rn] | regs[lanes, rm],
+                'EOR': lambda lanes: regs[lanes, rn] ^ regs[lanes, rm],
+                'SUB': lambda lanes: regs[lanes, rn] - regs[lanes, rm],
+                'ASR': lambda lanes: regs[lanes, rn] >> shamt,
+                'LSR': lambda lanes: (regs[lanes, rn] & 0xFFFFFFFF) >> shamt,
+                'LSL': lambda lanes: regs[lanes, rn] << shamt
+            }
+            op = ops[name]
+
+            def step(lanes):
+                regs[lanes, rd] = op(lanes)
+                return next_pc
+        elif inst.type == 'I':
+            rn, rd = inst.rn, inst.rd
+            immediate = -inst.immediate if name == 'SUBI' else inst.immediate
+
+            def step(lanes):
+                regs[lanes, rd] = regs[lanes, rn] + immediate
+                return next_pc
+        elif inst.type == 'D':
+            offset, rn, rt = 4 * inst.offset, inst.rn, inst.rt
+            if name == 'STUR':
+                def step(lanes):
+                    self.__store(lanes, regs[lanes, rn] + offset, regs[lanes, rt])
+                    return next_pc
+            elif name == 'LDUR':
+                def step(lanes):
+                    regs[lanes, rt] = self.__load(lanes, regs[lanes, rn] + offset)
+                    return next_pc
+            else:
+                def step(lanes):
+                    return next_pc
+        elif inst.type == 'B':
+            target = inst.address + inst.offset * 4
+
+            def step(lanes):
+                return target
+        elif inst.type == 'CB':
+            rt = inst.rt
+            target = inst.address + inst.offset * 4
+            if name == 'CBZ':
+                def step(lanes):
+                    return np.where(regs[lanes, rt] == 0, target, next_pc)
+            else:
+                def step(lanes):
+                    return np.where(regs[lanes, rt] != 0, target, next_pc)
+        elif inst.type == 'IM':
+            rd = inst.rd
+            val = _to_int64(inst.immediate << (inst.shift * 16))
+            if name == 'MOVZ':
+                def step(lanes):
+                    regs[lanes, rd] = val
+                    return next_pc
+            else:
+                mask = _to_int64((0x000000000000FFFF << (inst.shift * 16)) ^ 0xFFFFFFFFFFFFFFFF)
+
+                def step(lanes):
+                    regs[lanes, rd] = (regs[lanes, rd] & mask) | val
+                    return next_pc
+        else:
+            def step(lanes):
+                return next_pc
+        return step
+
+    def __check_address(self, a):
+        """
+        Checks that an address can be held in the lanes' memory.
+        :param a: The memory address.
+        """
+        if a & 3:
+            raise ValueError('ERROR: Lane memory can\'t hold unaligned address {}'.format(a))
+
+    def __load(self, lanes, addresses):
+        """
+        Reads one word per lane. Words never written read as 0.
+        :param lanes: The lanes, a slice or an index array.
+        :param addresses: The address read by each lane.
+        :return: The values read.
+        """
+        memory = self.__memory
+        index = (addresses - self.__memory_base) >> 2
+        valid = ((addresses & 3) == 0) & (index >= 0) & (index < memory.shape[1])
+        return np.where(valid, memory[self.__all[lanes], np.where(valid, index, 0)], 0)
+
+    def __store(self, lanes, addresses, values):
+        """
+        Writes one word per lane, growing memory if a lane writes outside it.
+        :param lanes: The lanes, a slice or an index array.
+        :param addresses: The address written by each lane.
+        :param values: The value written by each lane.
+        """
+        bad = (addresses & 3) != 0
+        if bad.any():
+            self.__check_address(int(addresses[bad][0]))
+        index = (addresses - self.__memory_base) >> 2
+        width = self.__memory.shape[1]
+        low = int(index.min())
+        if low < 0:
+            # Grow geometrically below the first word, moving the base down
+            grow = max(-low, width)
+            self.__memory = np.pad(self.__memory, ((0, 0), (grow, 0)))
+            self.__memory_base -= 4 * grow
+            index += grow
+            width += grow
+        top = int(index.max())
+        if top >= width:
+            self.__memory = np.pad(self.__memory, ((0, 0), (0, max(top + 1, 2 * width) - width)))
+        rows = self.__all[lanes]
+        self.__memory[rows, index] = values
+        self.__max_address[rows] = np.maximum(self.__max_address[rows], addresses)
+
+    def get_registers(self):
+        """
+        Returns the registers of every lane.
+        :return: An array of shape (K, num_registers).
+        """
+        return self.__registers
+
+    def get_memory(self):
+        """
+        Returns the memory of every lane, one word per column starting at get_memory_base().
+        :return: An array of shape (K, words).
+        """
+        return self.__memory
+
+    def get_memory_base(self):
+        """
+        Returns the address of the first column of get_memory().
+        :return: The memory address.
+        """
+        return self.__memory_base
+
+    def get_cycles(self):
+        """
+        Returns the number of cycles each lane has run.
+        :return: An array of shape (K,).
+        """
+        return self.__cycles
+
+    def lane_to_string(self, lane):
+        """
+        Returns the state of one lane in the format of a Simulator trace entry.
+        :param lane: The lane number.
+        :return: A string with the cycle line, the registers and the data memory.
+        """
+        memory = Memory(self.__data_begin, dict(
+            (self.__memory_base + 4 * i, val) for i, val in enumerate(self.__memory[lane].tolist()) if val))
+        max_address = int(self.__max_address[lane])
+        memory.max_address = max_address if max_address >= 0 else None
+        renderer = StateRenderer(self.__registers[lane].tolist(), memory, self.__data_begin)
+
+        inst = self.__last[lane]
+        if inst is None:
+            inst = self.__instructions[int(self.__pcs[lane])]
+        return '=' * 21 + '\n' \
+            + 'cycle:{}\t{}\t{}\n'.format(int(self.__cycles[lane]), inst.address, inst.assembly) + '\n' \
+            + renderer.registers_to_string() \
+            + '\n' \
+            + renderer.memory_to_string()
+
+    def write(self, output_file, compression=None):
+        """
+        Writes the state of every lane to output_file + '_lanes.txt', each one preceded by a 'lane:' line.
+        :param output_file: The output prefix.
+        :param compression: Compress the output (None, 'gz' or 'zst').
+        """
+        with TraceWriter(output_file + '_lanes.txt', compression) as out:
+            for lane in range(self.__lanes):
+                out.write('lane:{}\n'.format(lane))
+                out.write(self.lane_to_string(lane))
+
+    @staticmethod
+    def read_sweep(sweep_file, data, num_registers=32):
+        """
+        Reads the initial state of each lane from a sweep file. Each non-blank line not starting with '#' is one
+        lane, given as whitespace-separated assignments 'R<n>=<value>' or '<address>=<value>' applied over the
+        program's data.
+        :param sweep_file: The path of the sweep file.
+        :param data: The processed data of the program.
+        :param num_registers: The number of registers per lane.
+        :return: A tuple of the list of data dictionaries and the initial registers, one row per lane.
+        """
+        data_sets = []
+        registers = []
+        with open(sweep_file, 'r') as f:
+            for line_num, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                lane_data = dict(data)
+                lane_registers = [0] * num_registers
+                for assignment in line.split():
+                    target, _, value = assignment.partition('=')
+                    try:
+                        if target[:1] in ('R', 'r'):
+                            lane_registers[int(target[1:])] = int(value, 0)
+                        else:
+                            lane_data[int(target, 0)] = int(value, 0)
+                    except (ValueError, IndexError):
+                        raise ValueError('ERROR: Invalid assignment on line {}: \'{}\''.format(line_num, assignment))
+                data_sets.append(lane_data)
+                registers.append(lane_registers)
+        return data_sets, registers
+
+
+if __name__ == '__main__':
+    infile = ''
+    outfile = ''
+    sweep = ''
+    lanes = 1
+    compression = None
+    input_format = 'text'
+
+    # Get in/out file from command line arguments
+    for i in range(len(sys.argv)):
+        if sys.argv[i] == '-i':
+            infile = sys.argv[i + 1]
+        elif sys.argv[i] == '-o':
+            outfile = sys.argv[i + 1]
+        elif sys.argv[i] == '-s':
+            # Sweep file with the initial state of one lane per line
+            sweep = sys.argv[i + 1]
+        elif sys.argv[i] == '-l':
+            # Without a sweep file, run N identical lanes
+            lanes = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-z':
+            compression = sys.argv[i + 1]
+        elif sys.argv[i] == '-b':
+            input_format = sys.argv[i + 1]
+
+    d = Disassembler(infile, outfile, compression, input_format)
+    d.run()
+    try:
+        if sweep:
+            data_sets, registers = LaneSimulator.read_sweep(sweep, d.get_processed_data())
+        else:
+            data_sets, registers = [d.get_processed_data()] * lanes, None
+        s = LaneSimulator(d.get_processed_inst(), data_sets, registers=registers)
+        s.run()
+        s.write(outfile, compression)
+    except ValueError as ve:
+        print(ve, file=sys.stderr)
+        quit()
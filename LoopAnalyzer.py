@@ -0,0 +1,262 @@
+class LoopAnalyzer:
+    """
+    Finds counted loops and skips their iterations. The control-flow graph of the program gives the loops; a loop
+    whose body is one basic block closed by a CBNZ back to its start is summarized symbolically. Each register
+    written with ADD, SUB, ADDI, SUBI or MOVZ becomes an affine function of the registers at the start of the
+    iteration, and the counter tested by the CBNZ must change by a fixed amount per iteration. Other instructions
+    are allowed as long as their results are written before they are read, and loads and stores as long as their
+    addresses do not change between iterations.
+
+    When a loop runs N times, the registers after N - 1 iterations are computed by raising the affine map to the
+    power N - 1, and only the last iteration is performed. Memory written by the loop is left to that iteration,
+    since every store goes to the same address each time.
+    """
+    # loops running fewer times are stepped normally
+    min_iterations = 4
+
+    # R-format names with an affine result
+    affine_r = ('ADD', 'SUB')
+
+    def __init__(self, instructions):
+        self.__instructions = instructions
+
+        # loop head : summary, None if the loop at that address can't be accelerated
+        self.__summaries = {}
+
+    def build_cfg(self):
+        """
+        Splits the program into basic blocks and links them.
+        :return: A dictionary of block start address : (list of instructions, list of successor start addresses).
+        """
+        instructions = self.__instructions
+        if not instructions:
+            return {}
+        leaders = {min(instructions.keys())}
+        for address, inst in instructions.items():
+            if inst.type in ('B', 'CB'):
+                leaders.add(address + inst.offset * 4)
+                leaders.add(address + 4)
+
+        cfg = {}
+        for start in sorted(a for a in leaders if a in instructions):
+            block = []
+            address = start
+            while address in instructions and (not block or address not in leaders):
+                inst = instructions[address]
+                block.append(inst)
+                address += 4
+                if inst.type in ('B', 'CB', 'BREAK'):
+                    break
+
+            last = block[-1]
+            successors = []
+            if last.type in ('B', 'CB'):
+                successors.append(last.address + last.offset * 4)
+            if last.type not in ('B', 'BREAK') and address in instructions:
+                successors.append(address)
+            cfg[start] = (block, successors)
+        return cfg
+
+    def find_loops(self, cfg=None):
+        """
+        Finds the back edges of the control-flow graph, i.e. branches to a block at or before the branching block.
+        :param cfg: The graph from build_cfg, built if not given.
+        :return: A sorted list of (loop head, block with the back edge) tuples.
+        """
+        if cfg is None:
+            cfg = self.build_cfg()
+        return sorted((successor, start) for start, (_, successors) in cfg.items()
+                      for successor in successors if successor <= start)
+
+    def find_counted_loops(self):
+        """
+        Finds the loops whose iterations can be skipped.
+        :return: A set of loop head addresses.
+        """
+        return set(head for head, tail in self.find_loops() if self.analyze(head) is not None)
+
+    def analyze(self, head):
+        """
+        Summarizes the loop starting at an address, once per address.
+        :param head: The address of the first instruction of the loop.
+        :return: A tuple of (body length, counter register, {register: (coefficients, constant)} for the registers
+        written with an affine value, load address expressions, store address expressions), or None if the body at
+        head is not a counted loop that can be accelerated.
+        """
+        try:
+            return self.__summaries[head]
+        except KeyError:
+            summary = self.__summaries[head] = self.__summarize(head)
+            return summary
+
+    def __summarize(self, head):
+        """
+        Builds the symbolic summary of one iteration of the loop at head. Affine values are (coefficients,
+        constant) tuples, the coefficients mapping registers (their value at the start of the iteration) to factors.
+        Values that are not affine are None.
+        :param head: The address of the first instruction of the loop.
+        :return: The summary described in analyze, or None.
+        """
+        body = []
+        address = head
+        while address in self.__instructions:
+            try:
+                inst = self.__instructions[address]
+            except ValueError:
+                # An InstructionMemory word that can't be decoded ends the body, so the loop is not accelerated
+                break
+            body.append(inst)
+            if inst.type in ('B', 'CB', 'BREAK'):
+                break
+            address += 4
+        if not body or body[-1].name != 'CBNZ' or body[-1].address + body[-1].offset * 4 != head:
+            return None
+
+        values = {}
+        read_first = set()
+        loads = []
+        stores = []
+
+        def read(r):
+            if r in values:
+                return values[r]
+            read_first.add(r)
+            return {r: 1}, 0
+
+        def add(a, b, sign=1):
+            if a is None or b is None:
+                return None
+            coefficients = dict(a[0])
+            for r, c in b[0].items():
+                coefficients[r] = coefficients.get(r, 0) + sign * c
+                if not coefficients[r]:
+                    del coefficients[r]
+            return coefficients, a[1] + sign * b[1]
+
+        for inst in body[:-1]:
+            if inst.type == 'R':
+                rn = read(inst.rn)
+                if inst.name in LoopAnalyzer.affine_r:
+                    values[inst.rd] = add(rn, read(inst.rm), 1 if inst.name == 'ADD' else -1)
+                else:
+                    if inst.name not in ('ASR', 'LSR', 'LSL'):
+                        read(inst.rm)
+                    values[inst.rd] = None
+            elif inst.type == 'I':
+                immediate = -inst.immediate if inst.name == 'SUBI' else inst.immediate
+                values[inst.rd] = add(read(inst.rn), ({}, immediate))
+            elif inst.type == 'IM':
+                if inst.name == 'MOVZ':
+                    values[inst.rd] = ({}, inst.immediate << (inst.shift * 16))
+                else:
+                    read(inst.rd)
+                    values[inst.rd] = None
+            elif inst.type == 'D':
+                address = add(read(inst.rn), ({}, 4 * inst.offset))
+                if inst.name == 'STUR':
+                    read(inst.rt)
+                    stores.append(address)
+                elif inst.name == 'LDUR':
+                    loads.append(address)
+                    values[inst.rt] = None
+            elif inst.type != 'NOP':
+                return None
+
+        counter = body[-1].rt
+        read(counter)
+
+        # A value that is not affine must not reach the next iteration, and addresses must not change
+        if any(values[r] is None for r in read_first if r in values):
+            return None
+        for address in loads + stores:
+            if address is None or any(r in values for r in address[0]):
+                return None
+        step = values.get(counter)
+        if step is None or step[0].get(counter) != 1 or any(r in values for r in step[0] if r != counter):
+            return None
+
+        affine = dict((r, value) for r, value in values.items() if value is not None)
+        return len(body), counter, affine, loads, stores
+
+    def invalidate(self):
+        """
+        Drops every summary, e.g. after an instruction was replaced.
+        """
+        self.__summaries.clear()
+
+    def accelerate(self, head, registers):
+        """
+        Skips all but the last iteration of the loop at head, updating the registers in place.
+        :param head: The PC, at the start of a loop.
+        :param registers: The register list.
+        :return: The number of cycles skipped, 0 if the loop was not accelerated.
+        """
+        summary = self.analyze(head)
+        if summary is None:
+            return 0
+        length, counter, affine, loads, stores = summary
+
+        def evaluate(value):
+            coefficients, constant = value
+            return constant + sum(c * registers[r] for r, c in coefficients.items())
+
+        # Registers the loop does not write are constants here, which fixes the counter step and every address
+        step = evaluate((dict((r, c) for r, c in affine[counter][0].items() if r != counter), affine[counter][1]))
+        start = registers[counter]
+        if not step or start % step or -start // step < LoopAnalyzer.min_iterations:
+            return 0
+        if set(evaluate(a) for a in loads) & set(evaluate(a) for a in stores):
+            return 0
+        skip = -start // step - 1
+
+        # Affine map of one iteration over the written registers, with a final row and column for the constant
+        written = sorted(affine)
+        index = dict((r, i) for i, r in enumerate(written))
+        size = len(written) + 1
+        matrix = []
+        for r in written:
+            coefficients, constant = affine[r]
+            row = [0] * size
+            row[-1] = constant
+            for s, c in coefficients.items():
+                if s in index:
+                    row[index[s]] += c
+                else:
+                    row[-1] += c * registers[s]
+            matrix.append(row)
+        matrix.append([0] * (size - 1) + [1])
+
+        vector = [registers[r] for r in written] + [1]
+        power = LoopAnalyzer.matrix_power(matrix, skip)
+        for i, r in enumerate(written):
+            registers[r] = sum(a * b for a, b in zip(power[i], vector))
+        return skip * length
+
+    @staticmethod
+    def matrix_power(matrix, n):
+        """
+        Raises a square integer matrix to a power by repeated squaring.
+        :param matrix: The matrix, a list of rows.
+        :param n: The power, at least 0.
+        :return: The matrix to the power n.
+        """
+        size = len(matrix)
+        result = [[int(i == j) for j in range(size)] for i in range(size)]
+        while n:
+            if n & 1:
+                result = LoopAnalyzer.matrix_multiply(result, matrix)
+            n >>= 1
+            if n:
+                matrix = LoopAnalyzer.matrix_multiply(matrix, matrix)
+        return result
+
+    @staticmethod
+    def matrix_multiply(a, b):
+        """
+        Multiplies two square integer matrices.
+        :param a: The left matrix, a list of rows.
+        :param b: The right matrix, a list of rows.
+        :return: The product.
+        """
+        columns = list(zip(*b))
+        return [[sum(x * y for x, y in zip(row, column)) for column in columns] for row in a]
@@ -0,0 +1,137 @@
+from array import array
+
+
+class Memory:
+    """
+    Word-addressed data memory. Words from the start of the data section are kept in a contiguous array('q') that
+    grows as higher addresses are written. Addresses below it or too far past it go to 4 KB pages allocated on first
+    write. Words never written read as 0.
+    """
+    # words the contiguous region may grow to before writes spill into pages
+    dense_words = 1 << 20
+    # words per page, and the shift turning an address into its page number
+    page_words = 1024
+    page_shift = 12
+
+    def __init__(self, base, data=None):
+        self.__base = base
+        self.__dense = array('q')
+
+        # page number : array of page_words words
+        self.__pages = {}
+
+        # address : value, for unaligned addresses and values that do not fit in 64 bits
+        self.__exact = {}
+
+        # Highest address written, None while memory is empty
+        self.max_address = None
+
+        if data:
+            for a, val in data.items():
+                self.write(a, val)
+
+    def read(self, a):
+        """
+        Reads and returns the value in a specified memory location.
+        :param a: The memory address.
+        :return: The value in memory address a, 0 if it was never written.
+        """
+        if self.__exact and a in self.__exact:
+            return self.__exact[a]
+        if a & 3:
+            return 0
+        i = (a - self.__base) >> 2
+        if 0 <= i < len(self.__dense):
+            return self.__dense[i]
+        page = self.__pages.get(a >> Memory.page_shift)
+        if page is None:
+            return 0
+        return page[(a >> 2) & (Memory.page_words - 1)]
+
+    def write(self, a, val):
+        """
+        Writes a value to a specified memory location.
+        :param a: The memory address.
+        :param val: The value to write to memory address a.
+        """
+        if self.max_address is None or a > self.max_address:
+            self.max_address = a
+
+        exact = self.__exact
+        if a & 3:
+            exact[a] = val
+            return
+        if exact:
+            exact.pop(a, None)
+
+        i = (a - self.__base) >> 2
+        if 0 <= i < Memory.dense_words:
+            words = self.__dense
+            if i >= len(words):
+                # Grow geometrically so streams of increasing stores stay amortized O(1)
+                size = min(max(i + 1, 2 * len(words)), Memory.dense_words)
+                words.frombytes(bytes(8 * (size - len(words))))
+        else:
+            page_num = a >> Memory.page_shift
+            words = self.__pages.get(page_num)
+            if words is None:
+                words = self.__pages[page_num] = array('q', bytes(8 * Memory.page_words))
+            i = (a >> 2) & (Memory.page_words - 1)
+
+        try:
+            words[i] = val
+        except OverflowError:
+            words[i] = 0
+            exact[a] = val
+
+    def clear(self):
+        """
+        Forgets every word, as if memory had never been written.
+        """
+        self.__dense = array('q')
+        self.__pages.clear()
+        self.__exact.clear()
+        self.max_address = None
+
+    def load_words(self, a, words):
+        """
+        Writes consecutive signed 32-bit words, copying them in one step when they start an empty contiguous region.
+        :param a: The address of the first word.
+        :param words: An array('i') or other sequence of the values.
+        """
+        if not len(words):
+            return
+        if a == self.__base and not self.__dense and len(words) <= Memory.dense_words:
+            self.__dense = array('q', words)
+            last = a + 4 * (len(words) - 1)
+            if self.max_address is None or last > self.max_address:
+                self.max_address = last
+            return
+        for i, val in enumerate(words):
+            self.write(a + 4 * i, val)
+
+    def __getitem__(self, a):
+        return self.read(a)
+
+    def __setitem__(self, a, val):
+        self.write(a, val)
+
+    def items(self):
+        """
+        Returns every stored word in address order, including zero words of the contiguous region and of pages.
+        :return: A list of (address, value) tuples.
+        """
+        # A page can share addresses with the contiguous region, where its words are never used, so the
+        # contiguous region is added after the pages
+        words = {}
+        for page_num, page in self.__pages.items():
+            first = page_num << Memory.page_shift
+            for i, val in enumerate(page):
+                words[first + 4 * i] = val
+        for i, val in enumerate(self.__dense):
+            words[self.__base + 4 * i] = val
+        words.update(self.__exact)
+        return sorted(words.items())
+
+    def keys(self):
+        return [a for a, _ in self.items()]
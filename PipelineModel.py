@@ -0,0 +1,269 @@
+import json
+from DataCache import DataCache
+
+
+class PipelineModel:
+    """
+    Timing model of a 5-stage in-order pipeline (IF, ID, EX, MEM, WB) with one instruction per stage. Like the
+    Profiler, it wraps the predecoded step functions and leaves the results of the simulation unchanged.
+
+    Each instruction is placed in ID one cycle after the previous one, later if a register it reads is not ready.
+    With forwarding, an ALU result can be used by the next instruction and a loaded value one instruction later;
+    without it, values are read from the register file once written in WB. Conditional branches are predicted in
+    IF and resolved in EX; a wrong prediction costs mispredict_penalty cycles. There is no branch target buffer, so
+    a branch target is only known once the branch is decoded: B and correctly predicted taken branches cost
+    taken_penalty cycles, and correctly predicted not taken branches cost nothing. A load or store missing the data
+    cache holds the whole pipeline for miss_penalty cycles; dirty lines are written back through a write buffer at
+    no cost.
+    """
+    stages = 5
+    predictors = ('not_taken', 'taken', 'btfn', '2bit')
+
+    def __init__(self, forwarding=True, predictor='2bit', predictor_entries=256, mispredict_penalty=2,
+                 taken_penalty=1, cache_size=1024, cache_line=16, cache_ways=2, miss_penalty=10):
+        if predictor not in PipelineModel.predictors:
+            raise ValueError('ERROR: Unknown branch predictor \'{}\''.format(predictor))
+        if predictor_entries < 1:
+            raise ValueError('ERROR: The branch predictor needs at least one entry')
+        self.forwarding = forwarding
+        self.predictor = predictor
+        self.mispredict_penalty = mispredict_penalty
+        self.taken_penalty = taken_penalty
+        self.miss_penalty = miss_penalty
+        self.cache = DataCache(cache_size, cache_line, cache_ways)
+
+        # 2-bit saturating counters, 0 and 1 predicting not taken, 2 and 3 taken
+        self.__counters = [1] * predictor_entries
+
+        # cycle the last instruction was in ID, and register : first cycle a reader of it can be in ID
+        self.__time = 1
+        self.__ready = {}
+
+        self.instructions = 0
+        self.data_stalls = 0
+        self.control_stalls = 0
+        self.memory_stalls = 0
+        self.branches = 0
+        self.mispredictions = 0
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Creates a model from a command line specification.
+        :param spec: 'default', or comma-separated key=value pairs of __init__ arguments, e.g.
+        'predictor=btfn,cache_size=4096,forwarding=0'.
+        :return: The PipelineModel.
+        """
+        kwargs = {}
+        if spec != 'default':
+            for pair in spec.split(','):
+                key, _, value = pair.partition('=')
+                if key == 'predictor':
+                    kwargs[key] = value
+                elif key == 'forwarding':
+                    kwargs[key] = value not in ('0', 'false', 'no', 'off')
+                elif key in ('predictor_entries', 'mispredict_penalty', 'taken_penalty', 'cache_size', 'cache_line',
+                             'cache_ways', 'miss_penalty'):
+                    try:
+                        kwargs[key] = int(value)
+                    except ValueError:
+                        raise ValueError('ERROR: {} must be an integer, not \'{}\''.format(key, value))
+                else:
+                    raise ValueError('ERROR: Unknown timing option \'{}\''.format(key))
+        return cls(**kwargs)
+
+    def wrap(self, step, inst, registers):
+        """
+        Wraps the step function of an instruction with the timing model.
+        :param step: The step function returning the next PC.
+        :param inst: The Instruction it performs.
+        :param registers: The simulator's register list, read to find load and store addresses.
+        :return: A step function with the same behaviour that also advances the model.
+        """
+        sources, dest = inst.operands()
+        issue = self.__issue
+
+        if inst.type == 'CB':
+            pc = inst.address
+            backward = inst.offset < 0
+            is_taken = inst.is_taken
+
+            def timed():
+                issue(sources, dest, branch=(pc, is_taken(registers), backward))
+                return step()
+        elif inst.type == 'B':
+            def timed():
+                issue(sources, dest, jump=True)
+                return step()
+        elif inst.type == 'D' and inst.name in ('LDUR', 'STUR'):
+            rn = inst.rn
+            offset = 4 * inst.offset
+            write = inst.name == 'STUR'
+
+            def timed():
+                issue(sources, dest, access=(registers[rn] + offset, write))
+                return step()
+        else:
+            def timed():
+                issue(sources, dest)
+                return step()
+        return timed
+
+    def __issue(self, sources, dest, access=None, branch=None, jump=False):
+        """
+        Advances the model by one instruction.
+        :param sources: The registers the instruction reads.
+        :param dest: The register it writes, or None.
+        :param access: (address, is store) for a load or store.
+        :param branch: (PC, taken, backward) for a conditional branch.
+        :param jump: True for B.
+        """
+        t = self.__time + 1
+        ready = self.__ready
+        for r in sources:
+            if ready.get(r, 0) > t:
+                self.data_stalls += ready[r] - t
+                t = ready[r]
+        self.instructions += 1
+
+        # Cycles the instruction holds MEM past its slot
+        held = 0
+        if access is not None and not self.cache.access(*access):
+            held = self.miss_penalty
+            self.memory_stalls += held
+
+        if dest is not None:
+            if not self.forwarding:
+                ready[dest] = t + 3 + held
+            elif access is not None:
+                ready[dest] = t + 2 + held
+            else:
+                ready[dest] = t + 1
+
+        if branch is not None:
+            self.branches += 1
+            if not self.__predict(*branch):
+                self.mispredictions += 1
+                self.control_stalls += self.mispredict_penalty
+                held += self.mispredict_penalty
+            elif branch[1]:
+                self.control_stalls += self.taken_penalty
+                held += self.taken_penalty
+        elif jump:
+            self.control_stalls += self.taken_penalty
+            held += self.taken_penalty
+        self.__time = t + held
+
+    def __predict(self, pc, taken, backward):
+        """
+        Predicts a conditional branch and trains the predictor with its outcome.
+        :param pc: The address of the branch.
+        :param taken: Whether the branch was taken.
+        :param backward: Whether its target is before it.
+        :return: True if the prediction was correct.
+        """
+        if self.predictor == 'not_taken':
+            return not taken
+        if self.predictor == 'taken':
+            return taken
+        if self.predictor == 'btfn':
+            return taken == backward
+        counters = self.__counters
+        i = (pc >> 2) % len(counters)
+        predicted = counters[i] >= 2
+        if taken:
+            counters[i] = min(counters[i] + 1, 3)
+        else:
+            counters[i] = max(counters[i] - 1, 0)
+        return predicted == taken
+
+    def get_cycles(self):
+        """
+        Returns the cycles taken so far, up to the last instruction leaving WB.
+        :return: The cycle count.
+        """
+        if not self.instructions:
+            return 0
+        return self.__time + PipelineModel.stages - 2
+
+    def get_cpi(self):
+        """
+        Returns the cycles per instruction.
+        :return: The CPI, 0 before any instruction.
+        """
+        return self.get_cycles() / self.instructions if self.instructions else 0.0
+
+    def to_dict(self):
+        """
+        Returns the configuration and counters in a JSON-serializable form.
+        :return: A dictionary of the counters.
+        """
+        return {
+            'config': {
+                'forwarding': self.forwarding,
+                'predictor': self.predictor,
+                'predictor_entries': len(self.__counters),
+                'mispredict_penalty': self.mispredict_penalty,
+                'taken_penalty': self.taken_penalty,
+                'miss_penalty': self.miss_penalty
+            },
+            'cycles': self.get_cycles(),
+            'instructions': self.instructions,
+            'cpi': self.get_cpi(),
+            'stalls': {
+                'data': self.data_stalls,
+                'control': self.control_stalls,
+                'memory': self.memory_stalls
+            },
+            'branches': {
+                'conditional': self.branches,
+                'mispredicted': self.mispredictions
+            },
+            'cache': self.cache.to_dict()
+        }
+
+    def report(self):
+        """
+        Returns the timing report: CPI, stall breakdown, branch prediction and cache hit rates.
+        :return: The report text.
+        """
+        cycles = self.get_cycles()
+        cache = self.cache
+
+        def percent(n, total):
+            return 100.0 * n / total if total else 0.0
+
+        out = 'cycles:{}\ninstructions:{}\nCPI:{:.3f}\n'.format(cycles, self.instructions, self.get_cpi())
+
+        out += '\nstalls (cycles, % of cycles):\n'
+        out += 'pipeline fill\t{}\t{:.2f}%\n'.format(min(cycles, PipelineModel.stages - 1),
+                                                     percent(min(cycles, PipelineModel.stages - 1), cycles))
+        for name, n in (('data', self.data_stalls), ('control', self.control_stalls),
+                        ('memory', self.memory_stalls)):
+            out += '{}\t{}\t{:.2f}%\n'.format(name, n, percent(n, cycles))
+
+        out += '\nbranch prediction ({}{}):\n'.format(
+            self.predictor, ', {} entries'.format(len(self.__counters)) if self.predictor == '2bit' else '')
+        out += 'conditional\t{}\nmispredicted\t{}\naccuracy\t{:.2f}%\n'.format(
+            self.branches, self.mispredictions, 100.0 - percent(self.mispredictions, self.branches))
+
+        out += '\ndata cache ({} bytes, {}-way, {} sets of {}-byte lines):\n'.format(
+            cache.size, cache.ways, cache.num_sets, cache.line)
+        out += '\thits\tmisses\thit rate\n'
+        for name, hits, misses in (('loads', cache.load_hits, cache.load_misses),
+                                   ('stores', cache.store_hits, cache.store_misses),
+                                   ('total', cache.load_hits + cache.store_hits,
+                                    cache.load_misses + cache.store_misses)):
+            out += '{}\t{}\t{}\t{:.2f}%\n'.format(name, hits, misses, cache.hit_rate(hits, misses))
+        out += 'writebacks\t{}\n'.format(cache.writebacks)
+        return out
+
+    def write(self, output_file):
+        """
+        Writes the counters to output_file + '_timing.json' and the report to output_file + '_timing.txt'.
+        :param output_file: The output prefix.
+        """
+        with open(output_file + '_timing.json', 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        with open(output_file + '_timing.txt', 'w') as f:
+            f.write(self.report())
@@ -0,0 +1,141 @@
+import json
+import time
+
+
+class Profiler:
+    """
+    Counts how often each instruction runs. Instructions are profiled by wrapping their predecoded step functions,
+    so a Simulator without a Profiler runs exactly the same code as before.
+    """
+    # rows shown in each section of the hot spots report
+    report_rows = 20
+
+    def __init__(self):
+        # pc : executions
+        self.pc_counts = {}
+        # name : executions, and name : seconds spent in its step functions
+        self.name_counts = {}
+        self.name_times = {}
+        # pc : [taken, not taken] for CBZ/CBNZ
+        self.branches = {}
+        # address : count
+        self.loads = {}
+        self.stores = {}
+        # pc : assembly text, for the report
+        self.__assembly = {}
+
+    def wrap(self, step, inst, registers):
+        """
+        Wraps the step function of an instruction with counters.
+        :param step: The step function returning the next PC.
+        :param inst: The Instruction it performs.
+        :param registers: The simulator's register list, read to find load and store addresses.
+        :return: A step function with the same behaviour that also updates the counters.
+        """
+        pc = inst.address
+        name = inst.name
+        pc_counts = self.pc_counts
+        name_counts = self.name_counts
+        name_times = self.name_times
+        clock = time.perf_counter
+        self.__assembly[pc] = inst.assembly
+        pc_counts.setdefault(pc, 0)
+        name_counts.setdefault(name, 0)
+        name_times.setdefault(name, 0.0)
+
+        if inst.type == 'CB':
+            counts = self.branches.setdefault(pc, [0, 0])
+            is_taken = inst.is_taken
+
+            def profiled():
+                taken = is_taken(registers)
+                start = clock()
+                next_pc = step()
+                name_times[name] += clock() - start
+                pc_counts[pc] += 1
+                name_counts[name] += 1
+                counts[not taken] += 1
+                return next_pc
+        elif inst.type == 'D' and name in ('LDUR', 'STUR'):
+            accesses = self.loads if name == 'LDUR' else self.stores
+            rn = inst.rn
+            offset = 4 * inst.offset
+
+            def profiled():
+                address = registers[rn] + offset
+                start = clock()
+                next_pc = step()
+                name_times[name] += clock() - start
+                pc_counts[pc] += 1
+                name_counts[name] += 1
+                accesses[address] = accesses.get(address, 0) + 1
+                return next_pc
+        else:
+            def profiled():
+                start = clock()
+                next_pc = step()
+                name_times[name] += clock() - start
+                pc_counts[pc] += 1
+                name_counts[name] += 1
+                return next_pc
+        return profiled
+
+    def to_dict(self):
+        """
+        Returns the counters in a JSON-serializable form.
+        :return: A dictionary of the counters.
+        """
+        return {
+            'cycles': sum(self.pc_counts.values()),
+            'pc': dict((str(pc), n) for pc, n in sorted(self.pc_counts.items()) if n),
+            'name': dict((name, {'count': n, 'seconds': self.name_times[name]})
+                         for name, n in sorted(self.name_counts.items()) if n),
+            'branches': dict((str(pc), {'taken': taken, 'not_taken': not_taken})
+                             for pc, (taken, not_taken) in sorted(self.branches.items()) if taken or not_taken),
+            'loads': dict((str(a), n) for a, n in sorted(self.loads.items())),
+            'stores': dict((str(a), n) for a, n in sorted(self.stores.items()))
+        }
+
+    def report(self):
+        """
+        Returns the hot spots report: instructions, names, branches and memory addresses sorted by count.
+        :return: The report text.
+        """
+        cycles = sum(self.pc_counts.values())
+        rows = Profiler.report_rows
+
+        def percent(n):
+            return 100.0 * n / cycles if cycles else 0.0
+
+        out = 'cycles:{}\n'.format(cycles)
+
+        out += '\nhot instructions:\n'
+        for pc, n in sorted(self.pc_counts.items(), key=lambda item: (-item[1], item[0]))[:rows]:
+            if n:
+                out += '{}\t{:.2f}%\t{}\t{}\n'.format(n, percent(n), pc, self.__assembly[pc])
+
+        out += '\ninstructions by name:\n'
+        for name, n in sorted(self.name_counts.items(), key=lambda item: (-item[1], item[0])):
+            if n:
+                out += '{}\t{:.2f}%\t{}\t{:.6f}s\n'.format(n, percent(n), name, self.name_times[name])
+
+        out += '\nbranches (taken, not taken):\n'
+        for pc, (taken, not_taken) in sorted(self.branches.items(), key=lambda item: (-sum(item[1]), item[0])):
+            if taken or not_taken:
+                out += '{}\t{}\t{}\t{}\n'.format(taken, not_taken, pc, self.__assembly[pc])
+
+        for title, accesses in (('loads', self.loads), ('stores', self.stores)):
+            out += '\n{} by address:\n'.format(title)
+            for a, n in sorted(accesses.items(), key=lambda item: (-item[1], item[0]))[:rows]:
+                out += '{}\t{}\n'.format(n, a)
+        return out
+
+    def write(self, output_file):
+        """
+        Writes the counters to output_file + '_prof.json' and the hot spots report to output_file + '_prof.txt'.
+        :param output_file: The output prefix.
+        """
+        with open(output_file + '_prof.json', 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        with open(output_file + '_prof.txt', 'w') as f:
+            f.write(self.report())
@@ -0,0 +1,420 @@
+import asyncio
+import itertools
+import json
+import os
+import socket
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from BatchRunner import run_job
+
+
+def _warm_up():
+    """
+    Runs in each worker process when the server starts, so the first jobs do not pay for starting the workers.
+    :return: The worker's process id.
+    """
+    return os.getpid()
+
+
+class SimulationServer:
+    """
+    Local server running disassembly and simulation jobs on a pool of worker processes that stay up between jobs.
+    Clients send one JSON request per line and get one JSON response per line:
+
+        {"op": "submit", "input": path} or {"op": "submit", "program": text}, with optional "options" (see run_job)
+        and "wait": false to be refused instead of waiting when the queue is full -> {"id": n}
+        {"op": "status", "id": n} -> {"id": n, "status": "queued", "running", "ok", "error" or "timeout"}
+        {"op": "result", "id": n} -> the job result once the job is done
+        {"op": "stream", "id": n} -> {"id": n, "chunk": text} lines of the _sim.txt trace as it is written, then
+        the job result with "done": true
+        {"op": "stats"} -> {"jobs": the number of jobs in each state, "queue_length": n}
+        {"op": "shutdown"} -> stops the server once the running jobs are done
+
+    Errors are reported as {"error": message}. Submissions wait while the queue holds queue_size jobs, so a client
+    submitting faster than the workers run slows down instead of filling memory. Finished jobs are forgotten
+    job_ttl seconds after they end; their output files are kept.
+    """
+    # bytes of trace sent per chunk, and seconds between checks for new trace output
+    chunk_size = 1 << 16
+    poll_interval = 0.05
+
+    # characters of trace a job buffers before writing, kept small so streams follow the job closely
+    buffer_size = 1 << 12
+
+    def __init__(self, output_dir, workers=None, queue_size=64, options=None, job_ttl=600):
+        self.__output_dir = output_dir
+        self.__workers = workers or os.cpu_count() or 1
+        self.__queue_size = queue_size
+        self.__options = {'buffer_size': SimulationServer.buffer_size}
+        self.__options.update(options or {})
+        self.__job_ttl = job_ttl
+        self.__ids = itertools.count(1)
+
+        # id : job dictionary with 'id', 'input', 'output', 'options', 'status', 'result', the 'done' event and the
+        # 'finished' time
+        self.__jobs = {}
+        # ids of finished jobs, oldest first
+        self.__finished = deque()
+        self.__queue = None
+        self.__pool = None
+        self.__stopped = None
+
+    async def serve(self, host='127.0.0.1', port=0, path=None, ready=None):
+        """
+        Runs the server until a shutdown request.
+        :param host: The address to listen on for TCP.
+        :param port: The TCP port, 0 for any free port.
+        :param path: A Unix socket path to listen on instead of TCP.
+        :param ready: Called with the TCP port or socket path once the server accepts connections.
+        """
+        if not os.path.isdir(self.__output_dir):
+            os.makedirs(self.__output_dir)
+        loop = asyncio.get_running_loop()
+        self.__queue = asyncio.Queue(self.__queue_size)
+        self.__stopped = asyncio.Event()
+        self.__pool = ProcessPoolExecutor(max_workers=self.__workers)
+        try:
+            await asyncio.gather(*[loop.run_in_executor(self.__pool, _warm_up) for _ in range(self.__workers)])
+            runners = [asyncio.create_task(self.__run_jobs()) for _ in range(self.__workers)]
+
+            if path is not None:
+                server = await asyncio.start_unix_server(self.__handle, path)
+                address = path
+            else:
+                server = await asyncio.start_server(self.__handle, host, port)
+                address = server.sockets[0].getsockname()[1]
+            async with server:
+                if ready is not None:
+                    ready(address)
+                await self.__stopped.wait()
+
+            for runner in runners:
+                runner.cancel()
+        finally:
+            self.__pool.shutdown(cancel_futures=True)
+
+    async def __run_jobs(self):
+        """
+        Takes jobs from the queue and runs them on the pool, one at a time.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.__queue.get()
+            job['status'] = 'running'
+            options = self.__job_options(job)
+            try:
+                job['result'] = await loop.run_in_executor(self.__pool, run_job, job['input'], job['output'], options)
+            except Exception as e:
+                job['result'] = {'input': job['input'], 'output': job['output'], 'status': 'error', 'cycles': 0,
+                                 'seconds': 0.0, 'message': 'ERROR: {}: {}'.format(type(e).__name__, e)}
+            job['status'] = job['result']['status']
+            job['finished'] = loop.time()
+            self.__finished.append(job['id'])
+            job['done'].set()
+            self.__queue.task_done()
+            self.__expire()
+
+    def __job_options(self, job):
+        """
+        Combines the server's job options with the ones of a submission.
+        :param job: The job dictionary.
+        :return: The options for run_job.
+        """
+        options = dict(self.__options)
+        options.update(job['options'])
+        return options
+
+    def __expire(self):
+        """
+        Forgets the jobs that finished more than job_ttl seconds ago.
+        """
+        limit = asyncio.get_running_loop().time() - self.__job_ttl
+        finished = self.__finished
+        while finished and self.__jobs[finished[0]]['finished'] <= limit:
+            del self.__jobs[finished.popleft()]
+
+    async def __handle(self, reader, writer):
+        """
+        Answers the requests of one connection in order.
+        :param reader: The connection's stream reader.
+        :param writer: The connection's stream writer.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    op = request.get('op')
+                    if op == 'submit':
+                        await self.__send(writer, await self.__submit(request))
+                    elif op == 'status':
+                        job = self.__get_job(request)
+                        await self.__send(writer, {'id': job['id'], 'status': job['status']})
+                    elif op == 'result':
+                        job = self.__get_job(request)
+                        await job['done'].wait()
+                        await self.__send(writer, self.__result(job))
+                    elif op == 'stream':
+                        await self.__stream(self.__get_job(request), writer)
+                    elif op == 'stats':
+                        await self.__send(writer, self.stats())
+                    elif op == 'shutdown':
+                        await self.__send(writer, {'status': 'stopping'})
+                        self.__stopped.set()
+                        break
+                    else:
+                        raise ValueError('ERROR: Unknown op \'{}\''.format(op))
+                except (ValueError, KeyError) as e:
+                    message = str(e) if isinstance(e, ValueError) else 'ERROR: Missing {}'.format(e)
+                    await self.__send(writer, {'error': message})
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cancelled connections are the ones still open when the server stops
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def __send(writer, response):
+        """
+        Sends one response line, waiting while the client is not reading so slow clients are not buffered without
+        bound.
+        :param writer: The connection's stream writer.
+        :param response: The JSON-serializable response.
+        """
+        writer.write(json.dumps(response).encode() + b'\n')
+        await writer.drain()
+
+    async def __submit(self, request):
+        """
+        Creates a job and queues it, waiting for room in the queue unless the request has "wait": false.
+        :param request: The submit request.
+        :return: The response with the job id.
+        """
+        if 'program' not in request and 'input' not in request:
+            raise ValueError('ERROR: Submit needs an input or a program')
+        # Refused submissions must not use an id or leave a program file behind
+        if not request.get('wait', True) and self.__queue.full():
+            raise ValueError('ERROR: Queue full')
+        self.__expire()
+
+        job_id = next(self.__ids)
+        output = os.path.join(self.__output_dir, 'job{}'.format(job_id))
+        if 'program' in request:
+            infile = output + '.txt'
+            with open(infile, 'w') as f:
+                f.write(request['program'])
+        else:
+            infile = request['input']
+        job = {'id': job_id, 'input': infile, 'output': output, 'options': request.get('options', {}),
+               'status': 'queued', 'result': None, 'done': asyncio.Event(), 'finished': None}
+        self.__jobs[job_id] = job
+        await self.__queue.put(job)
+        return {'id': job_id}
+
+    def __get_job(self, request):
+        """
+        Looks up the job a request refers to.
+        :param request: A request with an 'id'.
+        :return: The job dictionary.
+        """
+        job = self.__jobs.get(request.get('id'))
+        if job is None:
+            raise ValueError('ERROR: Unknown job {}'.format(request.get('id')))
+        return job
+
+    @staticmethod
+    def __result(job):
+        """
+        Builds the response for a finished job.
+        :param job: The job dictionary.
+        :return: The job id and the result of run_job.
+        """
+        response = {'id': job['id']}
+        response.update(job['result'])
+        return response
+
+    async def __stream(self, job, writer):
+        """
+        Sends the _sim.txt trace of a job while it is written, then the job result.
+        :param job: The job dictionary.
+        :param writer: The connection's stream writer.
+        """
+        if self.__job_options(job).get('compression'):
+            raise ValueError('ERROR: Can\'t stream compressed output')
+
+        path = job['output'] + '_sim.txt'
+        offset = 0
+        while True:
+            # Check for completion before reading, so output written just before the job finished is not missed
+            done = job['done'].is_set()
+            chunk = b''
+            if job['status'] != 'queued' and os.path.exists(path):
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    chunk = f.read(SimulationServer.chunk_size)
+            if chunk:
+                offset += len(chunk)
+                await self.__send(writer, {'id': job['id'], 'chunk': chunk.decode()})
+            elif done:
+                break
+            else:
+                await asyncio.sleep(SimulationServer.poll_interval)
+
+        response = self.__result(job)
+        response['done'] = True
+        await self.__send(writer, response)
+
+    def stats(self):
+        """
+        Counts the jobs in each state.
+        :return: A dictionary with 'jobs', mapping each status to its number of jobs, and 'queue_length'.
+        """
+        counts = {'queued': 0, 'running': 0, 'ok': 0, 'error': 0, 'timeout': 0}
+        for job in self.__jobs.values():
+            counts[job['status']] += 1
+        return {'jobs': counts, 'queue_length': self.__queue.qsize()}
+
+
+class SimulationClient:
+    """
+    Blocking client for a SimulationServer, e.g. for scripts submitting many programs.
+    """
+
+    def __init__(self, host='127.0.0.1', port=None, path=None):
+        if path is not None:
+            self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.__socket.connect(path)
+        else:
+            self.__socket = socket.create_connection((host, port))
+        self.__file = self.__socket.makefile('rwb')
+
+    def close(self):
+        self.__file.close()
+        self.__socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def request(self, **request):
+        """
+        Sends a request and reads one response.
+        :param request: The request fields, e.g. op='status', id=1.
+        :return: The response dictionary.
+        """
+        self.__file.write(json.dumps(request).encode() + b'\n')
+        self.__file.flush()
+        return self.__read()
+
+    def __read(self):
+        line = self.__file.readline()
+        if not line:
+            raise ConnectionError('ERROR: Server closed the connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response
+
+    def submit(self, input_file=None, program=None, options=None, wait=True):
+        """
+        Submits a job.
+        :param input_file: The path of an input the server can read.
+        :param program: The text of an input, instead of input_file.
+        :param options: Job options, see run_job.
+        :param wait: Wait for room in the queue instead of failing when it is full.
+        :return: The job id.
+        """
+        request = {'op': 'submit', 'options': options or {}, 'wait': wait}
+        if program is not None:
+            request['program'] = program
+        else:
+            request['input'] = input_file
+        return self.request(**request)['id']
+
+    def status(self, job_id):
+        return self.request(op='status', id=job_id)['status']
+
+    def result(self, job_id):
+        return self.request(op='result', id=job_id)
+
+    def stream(self, job_id):
+        """
+        Streams the trace of a job.
+        :param job_id: The job id.
+        :return: A generator of trace text chunks. Its return value (StopIteration.value) is the job result.
+        """
+        self.__file.write(json.dumps({'op': 'stream', 'id': job_id}).encode() + b'\n')
+        self.__file.flush()
+        while True:
+            response = self.__read()
+            if response.get('done'):
+                return response
+            yield response['chunk']
+
+
+if __name__ == '__main__':
+    host = '127.0.0.1'
+    port = 0
+    path = None
+    outdir = 'server_out'
+    workers = None
+    queue_size = 64
+    job_ttl = 600
+    infile = ''
+    options = {}
+
+    # Get options from command line arguments
+    for i in range(len(sys.argv)):
+        if sys.argv[i] == '-p':
+            port = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-u':
+            # Listen on (or connect to) a Unix socket instead of TCP
+            path = sys.argv[i + 1]
+        elif sys.argv[i] == '-o':
+            outdir = sys.argv[i + 1]
+        elif sys.argv[i] == '-w':
+            # Number of worker processes, defaults to the number of cores
+            workers = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-q':
+            # Jobs that may wait in the queue before submissions block
+            queue_size = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-e':
+            # Seconds a finished job can still be queried
+            job_ttl = float(sys.argv[i + 1])
+        elif sys.argv[i] == '-t':
+            options['timeout'] = float(sys.argv[i + 1])
+        elif sys.argv[i] == '-f':
+            options['trace_interval'] = 0
+        elif sys.argv[i] == '-n':
+            options['trace_interval'] = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-C':
+            options['cache_dir'] = sys.argv[i + 1]
+        elif sys.argv[i] == '-i':
+            # Client mode: run an input on a running server and print its trace
+            infile = sys.argv[i + 1]
+
+    if infile:
+        with SimulationClient(host, port, path) as client:
+            job_id = client.submit(os.path.abspath(infile), options=options)
+            stream = client.stream(job_id)
+            try:
+                while True:
+                    sys.stdout.write(next(stream))
+            except StopIteration as stop:
+                result = stop.value
+        if result['status'] != 'ok':
+            print(result['message'], file=sys.stderr)
+            quit(1)
+    else:
+        s = SimulationServer(outdir, workers, queue_size, options, job_ttl)
+
+        def announce(address):
+            print('listening on {}'.format(address), flush=True)
+
+        asyncio.run(s.serve(host, port, path, announce))
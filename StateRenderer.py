@@ -0,0 +1,114 @@
+class StateRenderer:
+    """
+    Formats the register and data sections of the simulator trace. The text of each register row and each 8-word
+    memory row is cached and only re-formatted after a write marks it dirty, so a cycle costs a join of cached rows
+    instead of formatting every register and memory word again.
+    """
+    # registers printed per row and number of register rows
+    row_width = 8
+    register_rows = 4
+
+    def __init__(self, registers, memory, data_begin):
+        self.__registers = registers
+        self.__memory = memory
+        self.__data_begin = data_begin
+        self.reset()
+
+    def reset(self):
+        """
+        Drops every cached row, e.g. after the registers or memory were modified without going through the marks.
+        """
+        # Cached row strings, None when the row is dirty
+        self.__register_cache = [None] * StateRenderer.register_rows
+        self.__memory_cache = []
+
+        # Cached full section strings, None when any row is dirty
+        self.__register_str = None
+        self.__memory_str = None
+
+    def mark_register(self, r):
+        """
+        Marks the row holding a register as dirty.
+        :param r: The register that was written.
+        """
+        row = r // StateRenderer.row_width
+        if row < StateRenderer.register_rows:
+            self.__register_cache[row] = None
+            self.__register_str = None
+
+    def mark_memory(self, a):
+        """
+        Marks the row holding a memory address as dirty.
+        :param a: The memory address that was written.
+        """
+        self.__memory_str = None
+        offset = a - self.__data_begin
+        if offset >= 0 and offset % 4 == 0:
+            row = offset // (4 * StateRenderer.row_width)
+            if row < len(self.__memory_cache):
+                self.__memory_cache[row] = None
+
+    def registers_to_string(self):
+        """
+        Returns a string of the 32 registers, 4 lines with 8 each and a label for each line.
+        :return: A string representation of the registers.
+        """
+        if self.__register_str is None:
+            cache = self.__register_cache
+            for row in range(StateRenderer.register_rows):
+                if cache[row] is None:
+                    cache[row] = self.__format_register_row(row)
+            self.__register_str = 'registers:\n' + ''.join(cache)
+        return self.__register_str
+
+    def memory_to_string(self):
+        """
+        Returns a string of the data memory from the start of the data section to Memory.max_address, 8 words per
+        line, each line labelled with its first address.
+        :return: A string representation of the data memory.
+        """
+        if self.__memory_str is None:
+            data_max = self.__memory.max_address
+            if data_max is None:
+                data_max = self.__data_begin - 4
+            words = max(0, -(-(data_max + 4 - self.__data_begin) // 4))
+            full_rows, partial = divmod(words, StateRenderer.row_width)
+            num_rows = full_rows + (1 if partial else 0)
+
+            cache = self.__memory_cache
+            if len(cache) < num_rows:
+                cache.extend([None] * (num_rows - len(cache)))
+            for row in range(num_rows):
+                if cache[row] is None:
+                    cache[row] = self.__format_memory_row(row)
+
+            # A partial last row is padded with zeros, which is what the cached row already holds. When the last
+            # row is full a line of zeros without an address label follows it.
+            if partial:
+                self.__memory_str = 'data:\n' + ''.join(cache[:num_rows]) + '\n'
+            else:
+                self.__memory_str = 'data:\n' + ''.join(cache[:num_rows]) + '\t0' * StateRenderer.row_width + '\n\n'
+        return self.__memory_str
+
+    def __format_register_row(self, row):
+        """
+        Formats one line of registers.
+        :param row: The register row (0-3).
+        :return: The row label followed by the 8 register values.
+        """
+        first = row * StateRenderer.row_width
+        values = self.__registers[first:first + StateRenderer.row_width]
+        return 'r{:02d}:'.format(first) + ''.join(['\t' + str(v) for v in values]) + '\n'
+
+    def __format_memory_row(self, row):
+        """
+        Formats one line of data memory, with 0 for words that were never written.
+        :param row: The memory row, counted from the start of the data section.
+        :return: The first address of the row followed by the 8 memory values.
+        """
+        memory = self.__memory
+        first = self.__data_begin + row * 4 * StateRenderer.row_width
+        out = str(first) + ':'
+        for a in range(first, first + 4 * StateRenderer.row_width, 4):
+            out += '\t' + str(memory.read(a))
+        return out + '\n'
@@ -0,0 +1,77 @@
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TraceWriter:
+    """
+    Buffered writer for the _dis.txt and _sim.txt outputs. Strings are collected in memory and written in large
+    chunks, optionally through a gzip or zstd compressor. Use it as a context manager so the file is always flushed
+    and closed, even when the run stops on an error.
+    """
+    # characters buffered before a write, by default
+    buffer_size = 1 << 20
+
+    # compression name : file name suffix
+    compressions = {
+        None: '',
+        'gz': '.gz',
+        'zst': '.zst'
+    }
+
+    def __init__(self, path, compression=None, buffer_size=None):
+        if compression not in TraceWriter.compressions:
+            raise ValueError('ERROR: Unknown compression \'{}\''.format(compression))
+
+        self.path = path + TraceWriter.compressions[compression]
+        self.__buffer = []
+        self.__buffered = 0
+        self.__buffer_size = buffer_size or TraceWriter.buffer_size
+
+        if compression == 'gz':
+            self.__file = gzip.open(self.path, 'wb', compresslevel=6)
+        elif compression == 'zst':
+            if zstandard is None:
+                raise ValueError('ERROR: zst compression requires the zstandard package')
+            self.__file = zstandard.ZstdCompressor().stream_writer(open(self.path, 'wb'))
+        else:
+            self.__file = open(self.path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, s):
+        """
+        Adds a string to the buffer, flushing it once it holds buffer_size characters.
+        :param s: The string to write.
+        """
+        self.__buffer.append(s)
+        self.__buffered += len(s)
+        if self.__buffered >= self.__buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered strings to the file as one chunk.
+        """
+        if self.__buffer:
+            self.__file.write(''.join(self.__buffer).encode())
+            del self.__buffer[:]
+            self.__buffered = 0
+
+    def close(self):
+        """
+        Flushes the buffer and closes the file.
+        """
+        if self.__file is not None:
+            try:
+                self.flush()
+            finally:
+                self.__file.close()
+                self.__file = None
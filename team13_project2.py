@@ -1,161 +1,629 @@
+import contextlib
+import os
+import pickle
 import sys
+import zlib
+from array import array
 from Disassembler import Disassembler
+from InstructionMemory import InstructionMemory
+from LoopAnalyzer import LoopAnalyzer
+from Memory import Memory
+from PipelineModel import PipelineModel
+from Profiler import Profiler
+from BatchDisassembler import BatchDisassembler
+from BlockCompiler import BlockCompiler
+from DeltaTrace import DeltaTraceWriter
+from DisassemblyCache import DisassemblyCache
+from StateRenderer import StateRenderer
+from TraceWriter import TraceWriter
 
 
 class Simulator:
+    checkpoint_magic = b'T13CKPT1'
 
-    def __init__(self, inst, data, output_file, num_registers=32):
+    # program entry of an instruction that has not been decoded yet
+    pending = (None, None)
+
+    def __init__(self, inst, data, output_file, num_registers=32, compression=None, jit=True, profile=False,
+                 accelerate=True, timing=None, delta_trace=False):
         self.__output_file = output_file
+        self.__compression = compression
         self.__instructions = inst
         self.__data_begin = max(self.__instructions.keys()) + 4
-        self.__memory = data
+        self.__memory = Memory(self.__data_begin, data)
         self.__registers = [0] * num_registers
         self.__pc = 96
         self.__cycle = 0
-
-    def run(self):
+        self.__profiler = Profiler() if profile else None
+        self.__timing = timing
+        self.__hooks = None
+        self.__delta = None
+        if delta_trace:
+            self.__delta = DeltaTraceWriter(self.__registers, self.__memory, self.__data_begin)
+        self.__lazy = isinstance(inst, InstructionMemory)
+        self.__program_base, self.__program = self.__predecode()
+        self.__break_index = self.__find_break()
+        self.__renderer = StateRenderer(self.__registers, self.__memory, self.__data_begin)
+        self.__inst_strs = {}
+        self.__blocks = None
+        if jit and not profile and timing is None and not delta_trace:
+            self.__blocks = BlockCompiler(self.__instructions, self.__registers, self.__memory.read,
+                                          self.__memory.write, find_leaders=not self.__lazy)
+        self.__loops = None
+        self.__loop_heads = None
+        if self.__blocks is not None and accelerate:
+            self.__loops = LoopAnalyzer(self.__instructions)
+            # Finding the loops up front would decode every instruction of an InstructionMemory, so there each
+            # block start is checked when reached
+            if not self.__lazy:
+                self.__loop_heads = self.__loops.find_counted_loops()
+
+    def run(self, trace_interval=1, checkpoint_interval=0, checkpoint_file=None, buffer_size=None):
         """
         Calls all necessary functions to simulate the code.
-        """
-        type = ''
-        out = open(self.__output_file + '_sim.txt', 'w')
-        while type != 'BREAK':
-            self.__cycle += 1
-            try:
-                inst = self.__instructions[self.__pc]
-                type = inst['type']
-                f = getattr(self, '_Simulator__simulate_' + type.lower())
-                f(inst)
-                out.write(self.__get_sim_str(inst))
-            except KeyError:
-                print >> sys.stderr, "ERROR: Can't access instruction outside instruction memory ({})".format(self.__pc)
-                quit(1)
-
-    def __simulate_r(self, inst):
-        """
-        Simulates an R-format instruction by performing various arithmetic.
-        :param inst: A dictionary containing the the instruction's information.
-        """
-        name = inst['name']
-        rm = inst['rm']
-        shamt = inst['shamt']
-        rn = inst['rn']
-        rd = inst['rd']
-
-        rm_val = self.__read_register(rm)
-        rn_val = self.__read_register(rn)
-
-        op_dict = {
-            'AND': rn_val & rm_val,
-            'ADD': rn_val + rm_val,
-            'ORR': rn_val | rm_val,
-            'EOR': rn_val ^ rm_val,
-            'SUB': rn_val - rm_val,
-            'ASR': rn_val >> shamt,
-            'LSR': (rn_val % (1 << 32)) >> shamt,
-            'LSL': rn_val << shamt
+        :param trace_interval: Write the state every trace_interval cycles (1 traces every cycle). With 0 only the
+        final state is written, and compiled basic blocks are used when jit is enabled, with counted loops skipped
+        to their last iteration when accelerate is enabled. The final state is always written, so its cycle line
+        gives the cycle count.
+        :param checkpoint_interval: Save a checkpoint every checkpoint_interval cycles, 0 to never save one. Compiled
+        blocks save at the first block boundary at or after each multiple.
+        :param checkpoint_file: Where to save checkpoints, output_file + '_ckpt.bin' by default.
+        With delta_trace enabled every cycle is also recorded to output_file + '_trace.bin', whatever the
+        trace_interval.
+        :param buffer_size: Characters of trace buffered before they are written, TraceWriter.buffer_size by
+        default. Small buffers let readers follow the trace while it is written.
+        :return: The number of cycles simulated.
+        """
+        if checkpoint_file is None:
+            checkpoint_file = self.__output_file + '_ckpt.bin'
+        program = self.__program
+        base = self.__program_base
+        size = len(program)
+        halt = self.__break_index
+        pc = self.__pc
+        cycle = self.__cycle
+        delta = contextlib.nullcontext()
+        if self.__delta is not None:
+            delta = self.__delta
+            delta.open(self.__output_file + '_trace.bin', cycle)
+        with TraceWriter(self.__output_file + '_sim.txt', self.__compression, buffer_size) as out, delta:
+            if not trace_interval and self.__blocks is not None and self.__hooks is None:
+                pc, cycle = self.__run_blocks(pc, cycle, checkpoint_interval, checkpoint_file)
+
+            while True:
+                cycle += 1
+                index = (pc - base) >> 2
+                if not 0 <= index < size:
+                    print("ERROR: Can't access instruction outside instruction memory ({})".format(pc),
+                          file=sys.stderr)
+                    quit(1)
+                step, inst = program[index]
+                if step is None:
+                    step, inst = self.__decode_pending(index)
+                pc = step()
+                if index == halt:
+                    break
+                if trace_interval and not cycle % trace_interval:
+                    self.__pc = pc
+                    self.__cycle = cycle
+                    out.write(self.__get_sim_str(inst))
+                if checkpoint_interval and not cycle % checkpoint_interval:
+                    self.__pc = pc
+                    self.__cycle = cycle
+                    self.save_checkpoint(checkpoint_file)
+
+            self.__pc = pc
+            self.__cycle = cycle
+            out.write(self.__get_sim_str(inst))
+
+        if self.__profiler is not None:
+            self.__profiler.write(self.__output_file)
+        if self.__timing is not None:
+            self.__timing.write(self.__output_file)
+        return cycle
+
+    def __run_blocks(self, pc, cycle, checkpoint_interval=0, checkpoint_file=None):
+        """
+        Runs compiled basic blocks until the PC reaches an instruction that cannot start a block (a BREAK or an
+        address outside instruction memory), which is left for the interpreter loop. Counted loops found by the
+        LoopAnalyzer skip to their last iteration.
+        :param pc: The PC to start from.
+        :param cycle: The cycle count so far.
+        :param checkpoint_interval: Save a checkpoint once the cycle count reaches each multiple of this, 0 to never.
+        :param checkpoint_file: Where to save checkpoints.
+        :return: The PC and cycle count where the blocks stopped.
+        """
+        get_block = self.__blocks.get_block
+        loops = self.__loops
+        heads = self.__loop_heads
+        registers = self.__registers
+        block = get_block(pc)
+        if not checkpoint_interval and loops is None:
+            while block is not None:
+                pc, cycles = block()
+                cycle += cycles
+                block = get_block(pc)
+        elif not checkpoint_interval:
+            while block is not None:
+                if heads is None or pc in heads:
+                    cycle += loops.accelerate(pc, registers)
+                pc, cycles = block()
+                cycle += cycles
+                block = get_block(pc)
+        else:
+            next_checkpoint = (cycle // checkpoint_interval + 1) * checkpoint_interval
+            while block is not None:
+                if loops is not None and (heads is None or pc in heads):
+                    cycle += loops.accelerate(pc, registers)
+                pc, cycles = block()
+                cycle += cycles
+                if cycle >= next_checkpoint:
+                    self.__pc = pc
+                    self.__cycle = cycle
+                    self.save_checkpoint(checkpoint_file)
+                    next_checkpoint = (cycle // checkpoint_interval + 1) * checkpoint_interval
+                block = get_block(pc)
+
+        # Compiled blocks write registers and memory directly, so the cached rows are stale
+        self.__renderer.reset()
+        return pc, cycle
+
+    def set_instruction(self, address, inst):
+        """
+        Replaces an instruction in instruction memory, dropping any translation that covers it.
+        :param address: The address of the instruction, inside the current instruction memory.
+        :param inst: The new Instruction.
+        """
+        index = (address - self.__program_base) // 4
+        if address not in self.__instructions or inst.type == 'BREAK' or index == self.__break_index:
+            raise ValueError('ERROR: Can\'t replace instruction at {}'.format(address))
+        self.__instructions[address] = inst
+        self.__program[index] = (self.__decode(inst), inst)
+        if self.__blocks is not None:
+            self.__blocks.invalidate(address)
+        if self.__loops is not None:
+            self.__loops.invalidate()
+            if not self.__lazy:
+                self.__loop_heads = self.__loops.find_counted_loops()
+
+    def save_checkpoint(self, path, include_program=True):
+        """
+        Saves the machine state (PC, cycle count, registers and memory) to a compressed binary checkpoint. The file
+        is written next to path and renamed over it, so a crash never leaves a partial checkpoint.
+        :param path: The checkpoint file.
+        :param include_program: Also store the instructions, so a run can resume without disassembling again.
+        """
+        state = self.get_state(include_program)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(Simulator.checkpoint_magic)
+            f.write(zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL)))
+        os.replace(tmp, path)
+
+    def get_state(self, include_program=False):
+        """
+        Copies the machine state, in the form saved by save_checkpoint.
+        :param include_program: Also copy the program: the list of instructions, or for an InstructionMemory its raw
+        words in 'image', so nothing has to be decoded.
+        :return: A dictionary with the pc, cycle, registers, memory, max_address, instructions and image.
+        """
+        memory = self.__memory
+        state = {
+            'pc': self.__pc,
+            'cycle': self.__cycle,
+            'registers': list(self.__registers),
+            'memory': [(a, val) for a, val in memory.items() if val],
+            'max_address': memory.max_address,
+            'instructions': None,
+            'image': None
         }
-        rd_val = op_dict[name]
-        self.__write_register(rd, rd_val)
+        if include_program:
+            if self.__lazy:
+                state['image'] = self.__instructions.to_image()
+            else:
+                state['instructions'] = list(self.__instructions.values())
+        return state
 
-        self.__pc += 4
+    def set_state(self, state):
+        """
+        Restores a state returned by get_state or load_checkpoint. The instructions are left unchanged.
+        :param state: The state dictionary.
+        """
+        self.__memory.clear()
+        for a, val in state['memory']:
+            self.__memory.write(a, val)
+        self.__restore(state)
 
-    def __simulate_d(self, inst):
+    def set_position(self, pc, cycle):
         """
-        Simulates an D-format instruction by performing various arithmetic.
-        :param inst: A dictionary containing the the instruction's information.
+        Moves the PC and cycle count, e.g. for a debugger that changed the registers or memory directly to step
+        backwards. The cached trace rows are dropped.
+        :param pc: The PC of the next instruction to run.
+        :param cycle: The number of cycles run so far.
         """
-        name = inst['name']
-        offset = inst['offset']
-        rn = inst['rn']
-        rt = inst['rt']
+        self.__pc = pc
+        self.__cycle = cycle
+        self.__renderer.reset()
 
-        rn_val = self.__read_register(rn)
-        address = rn_val + 4 * offset
+    def set_hooks(self, hooks):
+        """
+        Attaches an object told about every register and memory write, before the write happens. Its
+        register_written(r, old, new) and memory_written(a, old, new) methods are called by the interpreter, so runs
+        with hooks attached do not use compiled blocks.
+        :param hooks: The hooks object, None to detach it.
+        """
+        self.__hooks = hooks
 
-        if name == 'STUR':
-            rt_val = self.__read_register(rt)
-            self.__write_memory(address, rt_val)
-        elif name == 'LDUR':
-            rt_val = self.__read_memory(address)
-            self.__write_register(rt, rt_val)
+    def step(self):
+        """
+        Runs a single cycle without writing the trace.
+        :return: True if the cycle ran the last instruction (the BREAK), which ends the program.
+        """
+        index = (self.__pc - self.__program_base) >> 2
+        if not 0 <= index < len(self.__program):
+            raise ValueError("ERROR: Can't access instruction outside instruction memory ({})".format(self.__pc))
+        step, inst = self.__program[index]
+        if step is None:
+            step, inst = self.__decode_pending(index)
+        self.__cycle += 1
+        self.__pc = step()
+        return index == self.__break_index
 
-        self.__pc += 4
+    def get_instruction(self, address):
+        """
+        Returns the instruction at an address.
+        :param address: The address.
+        :return: The Instruction, None outside instruction memory.
+        """
+        return self.__instructions.get(address)
 
-    def __simulate_i(self, inst):
+    def get_pc(self):
         """
-        Simulates an I-format instruction by performing various arithmetic.
-        :param inst: A dictionary containing the the instruction's information.
+        Returns the PC of the next instruction to run.
+        :return: The PC.
         """
-        name = inst['name']
-        immediate = inst['immediate']
-        rn = inst['rn']
-        rd = inst['rd']
-        rn_val = self.__read_register(rn)
-        if name == 'ADDI':
-            rd_val = rn_val + immediate
-        elif name == 'SUBI':
-            rd_val = rn_val - immediate
+        return self.__pc
 
-        self.__write_register(rd, rd_val)
-        self.__pc += 4
+    def get_cycle(self):
+        """
+        Returns the number of cycles run so far.
+        :return: The cycle count.
+        """
+        return self.__cycle
 
-    def __simulate_b(self, inst):
+    @staticmethod
+    def load_checkpoint(path):
         """
-        Simulates an B-format instruction by performing various arithmetic.
-        :param inst: A dictionary containing the the instruction's information.
+        Reads a checkpoint saved by save_checkpoint.
+        :param path: The checkpoint file.
+        :return: A dictionary with the pc, cycle, registers, memory, max_address, instructions and image (missing in
+        checkpoints saved before images were stored).
         """
-        offset = inst['offset']
-        self.__pc += offset * 4
+        with open(path, 'rb') as f:
+            raw = f.read()
+        if not raw.startswith(Simulator.checkpoint_magic):
+            raise ValueError('ERROR: Not a checkpoint file: \'{}\''.format(path))
+        return pickle.loads(zlib.decompress(raw[len(Simulator.checkpoint_magic):]))
 
-    def __simulate_cb(self, inst):
+    @classmethod
+    def from_checkpoint(cls, path, output_file, inst=None, **kwargs):
         """
-        Simulates an CB-format instruction by performing various arithmetic.
-        :param inst: A dictionary containing the the instruction's information.
+        Creates a simulator resuming from a checkpoint.
+        :param path: The checkpoint file.
+        :param output_file: The output prefix for the resumed run.
+        :param inst: The processed instructions, None to use the ones stored in the checkpoint.
+        :param kwargs: Other Simulator options (num_registers, compression, jit, profile, accelerate,
+        timing, delta_trace).
+        :return: A Simulator whose next run continues after the checkpointed cycle.
+        """
+        state = Simulator.load_checkpoint(path)
+        if inst is None and state.get('image') is not None:
+            inst = InstructionMemory.from_image(state['image'])
+        elif inst is None:
+            if state['instructions'] is None:
+                raise ValueError('ERROR: Checkpoint \'{}\' does not include the program'.format(path))
+            inst = dict((i.address, i) for i in state['instructions'])
+
+        s = cls(inst, dict(state['memory']), output_file, **kwargs)
+        s.__restore(state)
+        return s
+
+    @classmethod
+    def from_image(cls, input_file, output_file, input_format='text', **kwargs):
+        """
+        Creates a simulator running straight from an input file. Only the BREAK is searched for up front; each
+        instruction is decoded the first time it is reached, and no _dis.txt is written.
+        :param input_file: The input file.
+        :param output_file: The output prefix.
+        :param input_format: The input format ('text', 'le' or 'be').
+        :param kwargs: Other Simulator options (num_registers, compression, jit, profile, accelerate,
+        timing, delta_trace).
+        :return: A Simulator over an InstructionMemory.
         """
-        name = inst['name']
-        offset = inst['offset']
-        rt_val = self.__read_register(inst['rt'])
-        if (name == 'CBZ' and rt_val == 0) or (name == 'CBNZ' and rt_val != 0):
-            self.__pc += offset * 4
+        if input_format not in Disassembler.input_formats:
+            raise ValueError('ERROR: Unknown input format \'{}\''.format(input_format))
+        byteorder = Disassembler.input_formats[input_format]
+        image = None
+        if byteorder is None:
+            words = array('I', Disassembler.read_text(input_file))
+        else:
+            words, image = Disassembler.map_image(input_file, byteorder)
+        try:
+            brk = Disassembler.find_break(words)
+            num_inst = brk + 1 if brk >= 0 else len(words)
+            inst = InstructionMemory(96, words[:num_inst])
+            data = array('i')
+            data.frombytes(memoryview(words[num_inst:]).cast('B'))
+        finally:
+            if image is not None:
+                words.release()
+                image.close()
+
+        s = cls(inst, None, output_file, **kwargs)
+        s.__memory.load_words(s.__data_begin, data)
+        return s
+
+    def __restore(self, state):
+        """
+        Sets the PC, cycle count, registers and memory high-water mark from a checkpoint.
+        :param state: A dictionary returned by load_checkpoint.
+        """
+        self.__pc = state['pc']
+        self.__cycle = state['cycle']
+        self.__registers[:] = state['registers']
+        self.__memory.max_address = state['max_address']
+        self.__renderer.reset()
+
+    def __predecode(self):
+        """
+        Translates the processed instructions into a flat list indexed by (address - base) / 4. Each entry holds a
+        closure performing the instruction and returning the next PC, so the run loop does no per-cycle lookups.
+        With an InstructionMemory every entry starts as Simulator.pending and is translated when first reached.
+        :return: The base address and the list of (step, inst) tuples.
+        """
+        keys = self.__instructions.keys()
+        base = min(keys)
+        program = [Simulator.pending] * ((max(keys) - base) // 4 + 1)
+        if not self.__lazy:
+            for address, inst in self.__instructions.items():
+                program[(address - base) // 4] = (self.__decode(inst), inst)
+        return base, program
+
+    def __find_break(self):
+        """
+        Finds the BREAK ending the program. The disassembly stops at the first BREAK, so it can only be the last
+        instruction; a program without one runs until it branches forever or fetches outside instruction memory.
+        :return: The index of the BREAK in the program list, -1 if the last instruction is not a BREAK.
+        """
+        address = self.__data_begin - 4
+        try:
+            inst = self.__instructions[address]
+        except ValueError:
+            # An undecodable last word of an InstructionMemory is reported if it is reached
+            return -1
+        return (address - self.__program_base) // 4 if inst.type == 'BREAK' else -1
+
+    def __decode_pending(self, index):
+        """
+        Decodes and translates the instruction of a pending program entry.
+        :param index: The index of the entry.
+        :return: The (step, inst) tuple now in the entry.
+        """
+        try:
+            inst = self.__instructions[self.__program_base + 4 * index]
+        except ValueError as ve:
+            print(ve, file=sys.stderr)
+            quit(1)
+        entry = self.__program[index] = (self.__decode(inst), inst)
+        return entry
+
+    def __decode(self, inst):
+        """
+        Builds the closure for an instruction, wrapped with counters when profiling, with the timing model when one
+        is attached and with the recording of its cycles when writing a delta trace.
+        :param inst: The Instruction to translate.
+        :return: A function performing the instruction and returning the next PC.
+        """
+        f = getattr(self, '_Simulator__decode_' + inst.type.lower())
+        step = f(inst)
+        if self.__profiler is not None:
+            step = self.__profiler.wrap(step, inst, self.__registers)
+        if self.__timing is not None:
+            step = self.__timing.wrap(step, inst, self.__registers)
+        if self.__delta is not None:
+            step = self.__delta.wrap(step, inst)
+        return step
+
+    def get_profiler(self):
+        """
+        Returns the profiler collecting performance counters.
+        :return: The simulator's Profiler, None if profiling is disabled.
+        """
+        return self.__profiler
+
+    def get_timing(self):
+        """
+        Returns the pipeline timing model.
+        :return: The simulator's PipelineModel, None if timing is disabled.
+        """
+        return self.__timing
+
+    def __decode_r(self, inst):
+        """
+        Builds the closure for an R-format instruction.
+        :param inst: The Instruction to translate.
+        :return: A function performing the instruction and returning the next PC.
+        """
+        name = inst.name
+        rm = inst.rm
+        shamt = inst.shamt
+        rn = inst.rn
+        rd = inst.rd
+        next_pc = inst.address + 4
+        regs = self.__registers
+        write_register = self.__write_register
+
+        if name == 'AND':
+            def step():
+                write_register(rd, regs[rn] & regs[rm])
+                return next_pc
+        elif name == 'ADD':
+            def step():
+                write_register(rd, regs[rn] + regs[rm])
+                return next_pc
+        elif name == 'ORR':
+            def step():
+                write_register(rd, regs[rn] | regs[rm])
+                return next_pc
+        elif name == 'EOR':
+            def step():
+                write_register(rd, regs[rn] ^ regs[rm])
+                return next_pc
+        elif name == 'SUB':
+            def step():
+                write_register(rd, regs[rn] - regs[rm])
+                return next_pc
+        elif name == 'ASR':
+            def step():
+                write_register(rd, regs[rn] >> shamt)
+                return next_pc
+        elif name == 'LSR':
+            def step():
+                write_register(rd, (regs[rn] % (1 << 32)) >> shamt)
+                return next_pc
+        elif name == 'LSL':
+            def step():
+                write_register(rd, regs[rn] << shamt)
+                return next_pc
         else:
-            self.__pc += 4
+            raise KeyError(name)
+        return step
 
-    def __simulate_im(self, inst):
+    def __decode_d(self, inst):
         """
-        Simulates an IM-format instruction by performing various arithmetic.
-        :param inst: A dictionary containing the the instruction's information.
+        Builds the closure for a D-format instruction.
+        :param inst: The Instruction to translate.
+        :return: A function performing the instruction and returning the next PC.
         """
-        name = inst['name']
-        shift = inst['shift']
-        immediate = inst['immediate']
-        rd = inst['rd']
+        name = inst.name
+        offset = 4 * inst.offset
+        rn = inst.rn
+        rt = inst.rt
+        next_pc = inst.address + 4
+        regs = self.__registers
+        write_register = self.__write_register
+        read_memory = self.__read_memory
+        write_memory = self.__write_memory
+
+        if name == 'STUR':
+            def step():
+                write_memory(regs[rn] + offset, regs[rt])
+                return next_pc
+        elif name == 'LDUR':
+            def step():
+                write_register(rt, read_memory(regs[rn] + offset))
+                return next_pc
+        else:
+            def step():
+                return next_pc
+        return step
+
+    def __decode_i(self, inst):
+        """
+        Builds the closure for an I-format instruction.
+        :param inst: The Instruction to translate.
+        :return: A function performing the instruction and returning the next PC.
+        """
+        immediate = inst.immediate
+        rn = inst.rn
+        rd = inst.rd
+        next_pc = inst.address + 4
+        regs = self.__registers
+        write_register = self.__write_register
+
+        if inst.name == 'SUBI':
+            immediate = -immediate
+
+        def step():
+            write_register(rd, regs[rn] + immediate)
+            return next_pc
+        return step
 
-        val = immediate << (shift * 16)
-        if name == 'MOVZ':
-            self.__write_register(rd, val)
-        elif name == 'MOVK':
-            rd_val = self.__read_register(rd)
+    def __decode_b(self, inst):
+        """
+        Builds the closure for a B-format instruction.
+        :param inst: The Instruction to translate.
+        :return: A function returning the branch target.
+        """
+        target = inst.address + inst.offset * 4
+
+        def step():
+            return target
+        return step
+
+    def __decode_cb(self, inst):
+        """
+        Builds the closure for a CB-format instruction.
+        :param inst: The Instruction to translate.
+        :return: A function returning the branch target or the next PC.
+        """
+        rt = inst.rt
+        target = inst.address + inst.offset * 4
+        next_pc = inst.address + 4
+        regs = self.__registers
+
+        if inst.name == 'CBZ':
+            def step():
+                return target if regs[rt] == 0 else next_pc
+        else:
+            def step():
+                return target if regs[rt] != 0 else next_pc
+        return step
+
+    def __decode_im(self, inst):
+        """
+        Builds the closure for an IM-format instruction.
+        :param inst: The Instruction to translate.
+        :return: A function performing the instruction and returning the next PC.
+        """
+        shift = inst.shift
+        val = inst.immediate << (shift * 16)
+        rd = inst.rd
+        next_pc = inst.address + 4
+        regs = self.__registers
+        write_register = self.__write_register
+
+        if inst.name == 'MOVZ':
+            def step():
+                write_register(rd, val)
+                return next_pc
+        else:
             mask = (0x000000000000FFFF << (shift * 16)) ^ 0xFFFFFFFFFFFFFFFF
-            rd_val = (rd_val & mask) | val
-            self.__write_register(rd, rd_val)
 
-        self.__pc += 4
+            def step():
+                write_register(rd, (regs[rd] & mask) | val)
+                return next_pc
+        return step
 
-    def __simulate_nop(self, inst):
+    def __decode_nop(self, inst):
         """
-        Simulates an NOP-format instruction by performing various arithmetic.
-        :param inst: A dictionary containing the the instruction's information.
+        Builds the closure for a NOP instruction.
+        :param inst: The Instruction to translate.
+        :return: A function returning the next PC.
         """
-        self.__pc += 4
+        next_pc = inst.address + 4
+
+        def step():
+            return next_pc
+        return step
 
-    def __simulate_break(self, inst):
+    def __decode_break(self, inst):
         """
-        Simulates an BREAK-format instruction by performing various arithmetic.
-        :param inst: A dictionary containing the the instruction's information.
+        Builds the closure for a BREAK instruction.
+        :param inst: The Instruction to translate.
+        :return: A function returning the next PC.
         """
-        self.__pc += 4
-        pass
+        return self.__decode_nop(inst)
 
     def __read_register(self, r):
         """
@@ -171,15 +639,18 @@ class Simulator:
         :param r: The register (0-31).
         :param val: The value to write to register r.
         """
+        if self.__hooks is not None:
+            self.__hooks.register_written(r, self.__registers[r], val)
         self.__registers[r] = val
+        self.__renderer.mark_register(r)
 
     def __read_memory(self, a):
         """
         Reads and returns the value in a specified memory location.
         :param a: The memory address.
-        :return: The value in memory address a.
+        :return: The value in memory address a, 0 if it was never written.
         """
-        return self.__memory[a]
+        return self.__memory.read(a)
 
     def __write_memory(self, a, val):
         """
@@ -187,16 +658,24 @@ class Simulator:
         :param a: The memory address.
         :param val: The value to write to memory address a.
         """
-        self.__memory[a] = val
+        if self.__hooks is not None:
+            self.__hooks.memory_written(a, self.__memory.read(a), val)
+        self.__memory.write(a, val)
+        self.__renderer.mark_memory(a)
 
     def __get_sim_str(self, inst):
         """
         Returns a string to be printed to the command line for tracking state of the simulator.
-        :param inst: A dictionary containing the isntruction's information.
+        :param inst: The Instruction executed this cycle.
         :return:
         """
+        # Format each instruction's address and assembly once, the first time it is printed
+        inst_str = self.__inst_strs.get(inst.address)
+        if inst_str is None:
+            inst_str = self.__inst_strs[inst.address] = '\t{}\t{}\n'.format(inst.address, inst.assembly)
+
         out = '=' * 21 + '\n' \
-               + 'cycle:{}\t{}\t{}\n'.format(self.__cycle, inst['address'], inst['assembly']) + '\n' \
+               + 'cycle:' + str(self.__cycle) + inst_str + '\n' \
                + self.registers_to_string() \
                + '\n' \
                + self.memory_to_string()
@@ -212,7 +691,7 @@ class Simulator:
     def get_memory(self):
         """
         Returns the current memory.
-        :return: The simulator's memory.
+        :return: The simulator's Memory.
         """
         return self.__memory
 
@@ -221,51 +700,31 @@ class Simulator:
         Returns a string of the 32 registers, 4 lines with 8 each and a label for each line.
         :return: A string representation of the registers.
         """
-        out = 'registers:\n'
-        for i in range(4):
-            out += 'r{:02d}:'.format(i*8)
-            for j in range(8):
-                out += '\t{}'.format(self.__registers[i*8+j])
-            out += '\n'
-        return out
+        return self.__renderer.registers_to_string()
 
     def memory_to_string(self):
-
-        out = 'data:\n'
-
-        data_max = max(self.__memory.keys())
-
-        col = 0
-        for a in range(self.__data_begin, data_max + 4, 4):
-
-            if col == 0:
-                out += str(a) + ':'
-
-            if a not in self.__memory.keys():
-                val = 0
-            else:
-                val = self.__memory[a]
-
-            out += '\t' + str(val)
-
-            if col == 7:
-                out += '\n'
-                col = 0
-            else:
-                col += 1
-
-        while col < 8:
-            out += '\t0'
-            col += 1
-
-        out += '\n\n'
-
-        return out
+        """
+        Returns a string of the data memory, 8 words per line and a label for each line.
+        :return: A string representation of the data memory.
+        """
+        return self.__renderer.memory_to_string()
 
 
 if __name__ == '__main__':
     infile = ''
     outfile = ''
+    trace_interval = 1
+    compression = None
+    batch = False
+    input_format = 'text'
+    workers = 1
+    profile = False
+    checkpoint_interval = 0
+    resume = None
+    cache_dir = None
+    lazy = False
+    timing = None
+    delta_trace = False
 
     # Get in/out file from command line arguments
     for i in range(len(sys.argv)):
@@ -273,11 +732,72 @@ if __name__ == '__main__':
             infile = sys.argv[i + 1]
         elif sys.argv[i] == '-o':
             outfile = sys.argv[i + 1]
-
-    d = Disassembler(infile, outfile)
-    d.run()
-    processed_inst = d.get_processed_inst()
-    processed_data = d.get_processed_data()
-
-    s = Simulator(processed_inst, processed_data, outfile)
-    s.run()
+        elif sys.argv[i] == '-f':
+            # Fast-forward: only write the final state
+            trace_interval = 0
+        elif sys.argv[i] == '-n':
+            # Write the state every N cycles
+            trace_interval = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-z':
+            # Compress the outputs (gz or zst)
+            compression = sys.argv[i + 1]
+        elif sys.argv[i] == '-V':
+            # Decode the whole input at once with NumPy
+            batch = True
+        elif sys.argv[i] == '-b':
+            # Input is a raw binary image (le or be)
+            input_format = sys.argv[i + 1]
+        elif sys.argv[i] == '-j':
+            # Disassemble large inputs on N worker processes
+            workers = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-p':
+            # Write performance counters and a hot spots report
+            profile = True
+        elif sys.argv[i] == '-k':
+            # Save a checkpoint every N cycles
+            checkpoint_interval = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-r':
+            # Resume from a checkpoint, disassembling again only if -i is given
+            resume = sys.argv[i + 1]
+        elif sys.argv[i] == '-C':
+            # Reuse disassemblies of unchanged inputs from a cache directory
+            cache_dir = sys.argv[i + 1]
+        elif sys.argv[i] == '-l':
+            # Decode instructions when first reached instead of disassembling first, without writing _dis.txt
+            lazy = True
+        elif sys.argv[i] == '-T':
+            # Model pipeline timing and write a CPI report, options as 'default' or key=value,key=value
+            try:
+                timing = PipelineModel.from_spec(sys.argv[i + 1])
+            except ValueError as ve:
+                print(ve, file=sys.stderr)
+                quit()
+        elif sys.argv[i] == '-d':
+            # Also record every cycle to a binary delta trace, read back with DeltaTrace.py
+            delta_trace = True
+
+    processed_inst = None
+    processed_data = None
+    if infile and (not lazy or resume is not None):
+        def create():
+            if batch:
+                return BatchDisassembler(infile, outfile, compression, input_format)
+            return Disassembler(infile, outfile, compression, input_format, workers)
+
+        processed_inst, processed_data = DisassemblyCache.disassemble(create, infile, outfile, compression,
+                                                                      input_format, cache_dir)
+
+    if resume is not None:
+        s = Simulator.from_checkpoint(resume, outfile, processed_inst, compression=compression, profile=profile,
+                                      timing=timing, delta_trace=delta_trace)
+    elif lazy:
+        try:
+            s = Simulator.from_image(infile, outfile, input_format, compression=compression, profile=profile,
+                                     timing=timing, delta_trace=delta_trace)
+        except ValueError as ve:
+            print(ve, file=sys.stderr)
+            quit()
+    else:
+        s = Simulator(processed_inst, processed_data, outfile, compression=compression, profile=profile,
+                      timing=timing, delta_trace=delta_trace)
+    s.run(trace_interval, checkpoint_interval)